@@ -7,7 +7,13 @@
 # ==============================================================
 import argparse
 import subprocess as sp
+import multiprocessing as mp
+import heapq
 import os
+from gff_utils import read_gff
+
+class ConversionError(Exception):
+    pass
 
 path_bin = os.path.dirname(os.path.realpath(__file__))
 path_evm = ''
@@ -20,51 +26,192 @@ def main():
     if args.evm:
         path_evm = args.evm
 
+    # convert both predictions at the same time into temporary files
+    # with sorted gene blocks and merge them into the output
+    jobs = []
     i = 1
     for path in [args.braker1, args.braker2]:
         prefix = 'braker{}'.format(i)
-        gtf = read_braker(path, prefix)
         i += 1
+        jobs.append((path, prefix, '{}.{}.tmp'.format(path_out, prefix), args.evm_script))
+    try:
+        with mp.Pool(len(jobs)) as pool:
+            pool.starmap(convert, jobs)
+        merge([j[2] for j in jobs], path_out)
+    finally:
+        for j in jobs:
+            if os.path.exists(j[2]):
+                os.remove(j[2])
+
+def convert(path, prefix, out, evm_script=False):
+    # convert a BRAKER prediction to EVM format, the gene blocks
+    # in the output are sorted by seqid and start
+    if evm_script:
+        lines = gtf2evm_script(prefix, path)
+    else:
+        lines = gtf2evm(prefix, read_braker(path, prefix), grouped_by_gene(path))
+
+    # write blocks in the order of the conversion and sort
+    # only their positions in the file
+    blocks = []
+    try:
+        with open(out + '.unsorted', 'wb+') as file:
+            for seqid, start, text in gene_blocks(lines):
+                text = text.encode()
+                blocks.append((seqid, start, file.tell(), len(text)))
+                file.write(text)
+    except ConversionError:
+        os.remove(out + '.unsorted')
+        raise
+    blocks.sort(key=lambda b:(b[0], b[1]))
+    with open(out + '.unsorted', 'rb') as file_in, open(out, 'wb+') as file_out:
+        for seqid, start, offset, length in blocks:
+            file_in.seek(offset)
+            file_out.write(file_in.read(length))
+    os.remove(out + '.unsorted')
 
-        out = os.path.dirname(os.path.realpath(path_out)) + '/{}.gtf'.format(prefix)
-        with open(out, 'w+') as file:
-            file.write(gtf)
-        gtf2evm(prefix, out)
+def gene_blocks(lines):
+    # group gff lines into blocks that start with a gene line,
+    # yields seqid, start and text of each block
+    key = None
+    block = []
+    for line in lines:
+        line = line.rstrip('\n')
+        columns = line.split('\t', 5)
+        if len(columns) < 5:
+            continue
+        if block and columns[2] == 'gene':
+            yield key[0], key[1], ''.join(block)
+            block = []
+        if not block:
+            key = (columns[0], int(columns[3]))
+        block.append(line + '\n')
+    if block:
+        yield key[0], key[1], ''.join(block)
 
-def change_src(string, src):
+def merge(paths, out):
+    # merge files with sorted gene blocks into one file sorted by seqid and start,
+    # the output is replaced only after the merge is complete
+    files = [open(path, 'r') for path in paths]
+    try:
+        with open(out + '.tmp', 'w+') as file:
+            for seqid, start, text in heapq.merge(*[gene_blocks(f) for f in files], \
+                key=lambda b:(b[0], b[1])):
+                file.write(text)
+    finally:
+        for f in files:
+            f.close()
+    os.replace(out + '.tmp', out)
+
+def change_src(lines, src):
     # change the second cell in each row of a gtf file to src
-    result = []
-    string = string.split('\n')
-    for line in string:
-        line = line.split('\t')
+    for line in lines:
+        line = line.rstrip('\n').split('\t')
         if len(line) == 9:
             line[1] = src
-            result.append('\t'.join(line))
-    return '\n'.join(result)
+            yield '\t'.join(line)
 
 def read_braker(path, prefix):
-    # read braker.gtf file and get all CDS and exon lines
-    result = ''
-    with open(path, 'r') as file:
-        for line in file.readlines():
-            line = line.split('\t')
-            if len(line) == 9:
-                if not line[2] in ['CDS', 'exon']:
-                    continue
-                tx_id = prefix + '.' + line[8].split('transcript_id "')[1].split('"')[0]
-                gene_id = prefix + '.' + line[8].split('gene_id "')[1].split('"')[0]
-                line[8] = 'transcript_id "{}"; gene_id "{}";\n'.format(tx_id, gene_id)
-                result += '\t'.join(line)
-    return result
-
-def gtf2evm(prefix, gtf):
-    # transform gtf file to gff format accepted by EVM
-    cmd = '{}/EvmUtils/misc/augustus_GTF_to_EVM_GFF3.pl {}'.format(path_evm, gtf)
-    with sp.Popen(cmd, shell=True, stdout=sp.PIPE,  stderr=sp.PIPE) as p:
-        stdout, stderr = p.communicate()
-        evm = change_src(stdout.decode(), prefix)
-    with open(path_out, 'a+') as file:
-        file.write(evm)
+    # read braker.gtf file and yield all CDS and exon lines
+    # with the IDs of their transcript and gene prefixed
+    for feature in read_gff(path, types=['CDS', 'exon']):
+        tx_id = prefix + '.' + feature.get('transcript_id')
+        gene_id = prefix + '.' + feature.get('gene_id')
+        feature.attributes = 'transcript_id "{}"; gene_id "{}";'.format(tx_id, gene_id)
+        yield feature, tx_id, gene_id
+
+def grouped_by_gene(path):
+    # check if all lines of a gene are consecutive in a gtf file (as in
+    # the output of BRAKER), only the gene IDs are kept in memory
+    done = set()
+    gene_id = None
+    for feature in read_gff(path, types=['CDS', 'exon']):
+        g_id = feature.get('gene_id')
+        if g_id != gene_id:
+            if g_id in done:
+                return False
+            done.add(g_id)
+            gene_id = g_id
+    return True
+
+def genes(records, grouped=True):
+    # group records of read_braker() by gene, yields gene ID and {tx_id : [features]},
+    # if the records are grouped by gene, only one gene is kept in memory
+    gene_txs = {}
+    for feature, tx_id, gene_id in records:
+        if grouped and gene_id not in gene_txs:
+            for item in gene_txs.items():
+                yield item
+            gene_txs = {}
+        if gene_id not in gene_txs:
+            gene_txs[gene_id] = {}
+        if tx_id not in gene_txs[gene_id]:
+            gene_txs[gene_id][tx_id] = []
+        gene_txs[gene_id][tx_id].append(feature)
+    for item in gene_txs.items():
+        yield item
+
+def gtf2evm(src, records, grouped=True):
+    """Transform gtf records to the gff format accepted by EVM, same as
+    augustus_GTF_to_EVM_GFF3.pl with the source replaced by src:
+    a gene, mRNA and exon/CDS lines (from the CDS of the gtf) for each
+    transcript, exons in transcript order and phases from the CDS length
+
+    Args:
+        src (str): source of all lines
+        records (iterable): (feature, tx_id, gene_id) of each feature
+        grouped (bool): records are grouped by gene
+
+    Yields:
+        str: line in gff3 format
+    """
+    for gene_id, txs in genes(records, grouped):
+        tx_lines = []
+        gene_start, gene_end = None, None
+        for tx_id, features in txs.items():
+            cds = [f for f in features if f.type == 'CDS']
+            if not cds:
+                continue
+            seqid, strand = cds[0].seqid, cds[0].strand
+            coords = sorted([(f.start, f.end) for f in cds], reverse=(strand == '-'))
+            start = min([c[0] for c in coords])
+            end = max([c[1] for c in coords])
+            if gene_start is None or start < gene_start:
+                gene_start = start
+            if gene_end is None or end > gene_end:
+                gene_end = end
+            tx_lines.append([seqid, src, 'mRNA', start, end, '.', strand, '.', \
+                'ID={};Parent={}'.format(tx_id, gene_id)])
+            cds_len = 0
+            for i, (c_start, c_end) in enumerate(coords):
+                phase = (3 - cds_len % 3) % 3
+                cds_len += c_end - c_start + 1
+                tx_lines.append([seqid, src, 'exon', c_start, c_end, '.', strand, '.', \
+                    'ID={}.exon{};Parent={}'.format(tx_id, i + 1, tx_id)])
+                tx_lines.append([seqid, src, 'CDS', c_start, c_end, '.', strand, phase, \
+                    'ID=cds.{};Parent={}'.format(tx_id, tx_id)])
+        if not tx_lines:
+            continue
+        yield '\t'.join(map(str, [seqid, src, 'gene', gene_start, gene_end, '.', strand, \
+            '.', 'ID={}'.format(gene_id)]))
+        for line in tx_lines:
+            yield '\t'.join(map(str, line))
+
+def gtf2evm_script(prefix, path):
+    # transform gtf file to gff format accepted by EVM with
+    # augustus_GTF_to_EVM_GFF3.pl, yields the lines of its output
+    out = os.path.dirname(os.path.realpath(path_out)) + '/{}.gtf'.format(prefix)
+    with open(out, 'w+') as file:
+        for feature, tx_id, gene_id in read_braker(path, prefix):
+            file.write(feature.line() + '\n')
+    cmd = '{}/EvmUtils/misc/augustus_GTF_to_EVM_GFF3.pl {}'.format(path_evm, out)
+    with sp.Popen(cmd, shell=True, stdout=sp.PIPE, universal_newlines=True) as p:
+        for line in change_src(p.stdout, prefix):
+            yield line
+    # an incomplete output of a failed conversion must not be merged
+    if p.returncode:
+        raise ConversionError('error, {} failed with exit code {}'.format(cmd, \
+            p.returncode))
 
 def parseCmd():
     """Parse command line arguments
@@ -80,6 +227,8 @@ def parseCmd():
         help='BRAKER2 prediciton')
     parser.add_argument('--evm', type=str,
         help='Path where EVM is installed')
+    parser.add_argument('--evm_script', action='store_true',
+        help='Use augustus_GTF_to_EVM_GFF3.pl of EVM for the conversion')
     parser.add_argument('--out', type=str,
         help='Output file')
     return parser.parse_args()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# checkpoint.py: Completion markers for the steps of a partition run,
+# a step is skipped if the hash of its inputs didn't change
+# ==============================================================
+import hashlib
+import json
+import os
+
+# file hashes of this process, keyed by (path, size, mtime)
+hash_cache = {}
+
+def file_hash(path):
+    # sha1 of the content of a file, None if the file doesn't exist
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    cache_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if cache_key not in hash_cache:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                sha.update(chunk)
+        hash_cache[cache_key] = sha.hexdigest()
+    return hash_cache[cache_key]
+
+def input_key(files, values=[]):
+    """Hash of the content of all input files and additional values
+    (e.g. parameters or tool versions) of a step
+
+    Args:
+        files (list): paths of input files (scripts and config files included)
+        values (list): additional values that change the result of the step
+
+    Returns:
+        str: hex digest
+    """
+    sha = hashlib.sha1()
+    for path in files:
+        sha.update('{}={};'.format(os.path.basename(path), file_hash(path)).encode())
+    for value in values:
+        sha.update('{};'.format(value).encode())
+    return sha.hexdigest()
+
+def marker_path(dir, step):
+    return '{}/.{}.done'.format(dir, step)
+
+def is_done(dir, step, key, outputs=[]):
+    # check if a step was completed with the same inputs and
+    # if all its outputs still exist
+    path = marker_path(dir, step)
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path, 'r') as file:
+            marker = json.load(file)
+    except ValueError:
+        return False
+    return marker.get('key') == key and all([os.path.exists(o) for o in outputs])
+
+def mark_done(dir, step, key, value=None):
+    # write the completion marker of a step, value can hold a (json)
+    # result of the step
+    path = marker_path(dir, step)
+    with open(path + '.tmp', 'w+') as file:
+        json.dump({'key' : key, 'value' : value}, file)
+    os.replace(path + '.tmp', path)
+
+def clear(dir, step):
+    # remove the completion marker of a step before it is redone
+    path = marker_path(dir, step)
+    if os.path.exists(path):
+        os.remove(path)
+
+def load_value(dir, step):
+    # returns the value saved with the completion marker of a step
+    with open(marker_path(dir, step), 'r') as file:
+        return json.load(file)['value']
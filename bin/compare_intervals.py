@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# compare_intervals.py: In-process port of compare_intervals_exact.pl
+# for the CDS, transcript and gene level comparison of two gtf files
+# ==============================================================
+import argparse
+import subprocess as sp
+import tempfile
+import shutil
+import os
+import sys
+import re
+
+class EvalError(Exception):
+    pass
+
+class Score:
+    def __init__(self, tp, fn, fp):
+        self.tp = int(tp)
+        self.fn = int(fn)
+        self.fp = int(fp)
+
+    def sens(self):
+        if self.fn + self.tp > 0:
+            return self.tp / (self.fn + self.tp)
+        return 0
+
+    def spec(self):
+        if self.fp + self.tp > 0:
+            return self.tp / (self.fp + self.tp)
+        return 0
+
+    def f1(self):
+        if self.fn + self.tp + self.fp > 0:
+            return self.tp / (1/2 * (self.fn + self.fp) + self.tp)
+        return 0
+
+modes = ['cds', 'trans', 'gene']
+bin = os.path.dirname(os.path.realpath(__file__))
+
+# same line and key formats as ParseGFF, LoadIntervals and
+# HashKeysToArrIntervals in compare_intervals_exact.pl
+gff_line = re.compile(r'^(\S+)\t\S+\t(\S+)\t(\d+)\t(\d+)\t\S+\t([-+.])\t(\S+)(\t(.*)|\s*)$')
+region_line = re.compile(r'^(\S+)\t\S+\t(\S+)\t(\d+)\t(\d+)\t\S+\t([-+.])\t(\S+)\s*')
+gene_id_attr = re.compile(r'\sgene_id "(\S+)";')
+tx_id_attr = re.compile(r'\stranscript_id "(\S+)";')
+skip_line = re.compile(r'^\s*(#|$)')
+key_formats = [re.compile(r'^(.+)_(\d+)_(\d+)_[+-.]$'),
+    re.compile(r'^(.+)_(\d+)_(\d+)_[+-.]_[012.]$'),
+    re.compile(r'^(.+?)_(\d+).*_(\d+)_[+-.] $'),
+    re.compile(r'^(.+?)_(\d+).*_(\d+)_[+-.]_[012.] $')]
+
+class Annotation:
+    # CDS keys and transcript CDS chains of one gtf file, a prediction
+    # is sorted as eval_exp2.py did with 'sort -k1,1 -k4,4n -k5,5n'
+    # before compare_intervals_exact.pl
+
+    def __init__(self, path, sort=True):
+        self.path = path
+        # CDS key 'seqid_start_end_strand_phase' -> None (ordered set)
+        self.cds = {}
+        # CDS chain 'key1 key2 ... ' -> list of transcript IDs with that chain
+        self.chains = {}
+        self.tx2gene = {}
+        # first CDS line without gene or transcript ID, the Perl script
+        # only fails on it in the trans and gene mode
+        self.no_id = ''
+        self.read_gtf(sort)
+
+    def read_gtf(self, sort):
+        # keys are collected in the order of 'LC_ALL=C sort -k1,1 -k4,4n -k5,5n'
+        # if sort is set (input that is already sorted is detected while
+        # reading, otherwise the CDS lines are sorted in memory) or in file order
+        records = []
+        is_sorted = True
+        with open(self.path, 'r') as file:
+            for line in file:
+                if skip_line.match(line) or '\t' not in line:
+                    continue
+                match = gff_line.match(line)
+                if not match or match.group(2) != 'CDS':
+                    continue
+                gene_id = gene_id_attr.search(line)
+                tx_id = tx_id_attr.search(line)
+                if (not gene_id or not tx_id) and not self.no_id:
+                    self.no_id = line
+                rank = (match.group(1), int(match.group(3)), int(match.group(4)), \
+                    line.rstrip('\n'))
+                if records and rank < records[-1][0]:
+                    is_sorted = False
+                records.append((rank, '_'.join(match.group(1, 3, 4, 5, 6)), \
+                    tx_id.group(1) if tx_id and gene_id else '', \
+                    gene_id.group(1) if gene_id else ''))
+        if sort and not is_sorted:
+            records.sort(key=lambda r:r[0])
+
+        tx_keys = {}
+        for rank, key, tx_id, gene_id in records:
+            self.cds[key] = None
+            if not tx_id:
+                continue
+            if tx_id not in tx_keys:
+                tx_keys[tx_id] = []
+            tx_keys[tx_id].append(key)
+            self.tx2gene[tx_id] = gene_id
+        for tx_id, keys in tx_keys.items():
+            chain = ' '.join(keys) + ' '
+            if chain not in self.chains:
+                self.chains[chain] = []
+            self.chains[chain].append(tx_id)
+
+class Reference(Annotation):
+    # reference annotation with the pseudogene regions that
+    # don't overlap its CDS and transcripts
+
+    def __init__(self, path, pseudo=''):
+        # compare_intervals_exact.pl reads the reference in file order
+        super().__init__(path, sort=False)
+        self.cds_regions = {}
+        self.chain_regions = {}
+        if pseudo:
+            regions = load_regions(pseudo)
+            self.cds_regions = filter_regions(regions, self.cds)
+            self.chain_regions = filter_regions(regions, self.chains)
+
+def load_regions(path):
+    # read pseudogene regions and merge overlapping regions per sequence
+    regions = {}
+    with open(path, 'r') as file:
+        for line in file:
+            if skip_line.match(line) or '\t' not in line:
+                continue
+            match = region_line.match(line)
+            if not match:
+                raise EvalError('error, unexpected line format found: {}'.format(line))
+            start, end = int(match.group(3)), int(match.group(4))
+            if end - start + 1 < 0:
+                continue
+            if match.group(1) not in regions:
+                regions[match.group(1)] = []
+            regions[match.group(1)].append([start, end])
+
+    for seqid, coords in regions.items():
+        coords = sorted(coords, key=lambda c:c[0])
+        merged = []
+        i = 0
+        while i < len(coords):
+            left, right = coords[i]
+            j = i + 1
+            while j < len(coords) and right >= coords[j][0]:
+                right = max(right, coords[j][1])
+                j += 1
+            i = j
+            merged.append([left, right])
+        regions[seqid] = merged
+    return regions
+
+def key_intervals(keys):
+    # group keys by sequence as [start, end, key] sorted by start
+    intervals = {}
+    for key in keys:
+        for form in key_formats:
+            match = form.match(key)
+            if match:
+                break
+        else:
+            raise EvalError('error, unexpected key format found: "{}"\n'.format(key))
+        if match.group(1) not in intervals:
+            intervals[match.group(1)] = []
+        intervals[match.group(1)].append([int(match.group(2)), \
+            int(match.group(3)), key])
+    for seqid in intervals:
+        intervals[seqid].sort(key=lambda i:i[0])
+    return intervals
+
+def overlapping(regions, intervals):
+    # returns overlapping pairs (region, interval) in the same
+    # order as RemoveOverlapping in compare_intervals_exact.pl
+    for seqid in regions:
+        if seqid not in intervals:
+            continue
+        aa = regions[seqid]
+        bb = intervals[seqid]
+        i = 0
+        j = 0
+        while i < len(aa) and j < len(bb):
+            if aa[i][1] < bb[j][1]:
+                i += 1
+            elif aa[i][0] > bb[j][1]:
+                j += 1
+            else:
+                yield seqid, aa[i], bb[j]
+                j += 1
+
+def filter_regions(regions, keys):
+    # remove regions that overlap with any key of the reference
+    hits = set()
+    for seqid, region, interval in overlapping(regions, key_intervals(keys)):
+        hits.add((seqid, region[0], region[1]))
+    return {seqid : [r for r in coords if (seqid, r[0], r[1]) not in hits] \
+        for seqid, coords in regions.items()}
+
+def filter_keys(regions, keys):
+    # returns all keys that don't overlap with a region
+    if not regions:
+        return list(keys)
+    hits = set(i[2] for s, r, i in overlapping(regions, key_intervals(keys)))
+    return [k for k in keys if k not in hits]
+
+def gene_sets(chains1, chains2, tx2gene1, tx2gene2):
+    # replace CDS chains by gene IDs as in the gene level mode
+    # of compare_intervals_exact.pl
+    genes1 = {c : tx2gene1[t[0]] for c, t in chains1.items()}
+    genes2 = {c : tx2gene2[t[0]] for c, t in chains2.items()}
+    z1 = {}
+    z2 = {}
+    found = set()
+    for chain, gene in genes1.items():
+        z1[gene] = None
+        if chain in genes2:
+            z2[gene] = None
+            found.add(genes2[chain])
+    for gene in genes2.values():
+        if gene not in found:
+            z2[gene] = None
+    return z1, z2
+
+def compare_keys(keys1, keys2, path1, path2):
+    if not keys1:
+        raise EvalError('error, no intervals in file: {}\n'.format(path1))
+    if not keys2:
+        raise EvalError('error, no intervals in file: {}\n'.format(path2))
+    match = sum(1 for k in keys1 if k in keys2)
+    return Score(match, len(keys1) - match, len(keys2) - match)
+
+def check_ids(annot):
+    if annot.no_id:
+        raise EvalError('error, GTF formatted file with gene and ' \
+            + 'transcript ID is expected: {}\n'.format(annot.no_id))
+
+def compare(annot, pred, pseudo='', modes=modes):
+    """Compare a prediction to a reference annotation
+
+    Args:
+        annot (Reference or str): reference annotation, a Reference can be
+            reused for several predictions
+        pred (Annotation or str): gene prediction
+        pseudo (str): file with pseudogene regions, only used if annot is a path
+        modes (list): modes of ['cds', 'trans', 'gene'] that are compared
+
+    Returns:
+        dictionary: Score for each mode of modes
+    """
+    if not isinstance(annot, Reference):
+        annot = Reference(annot, pseudo)
+    if not isinstance(pred, Annotation):
+        pred = Annotation(pred)
+
+    cds = set(filter_keys(annot.cds_regions, pred.cds))
+    chains = {c : pred.chains[c] for c in filter_keys(annot.chain_regions, pred.chains)}
+
+    score = {}
+    if 'cds' in modes:
+        score['cds'] = compare_keys(annot.cds, cds, annot.path, pred.path)
+    if 'trans' in modes or 'gene' in modes:
+        check_ids(annot)
+        check_ids(pred)
+    if 'trans' in modes:
+        score['trans'] = compare_keys(annot.chains, chains, annot.path, pred.path)
+    if 'gene' in modes:
+        score['gene'] = compare_keys(*gene_sets(annot.chains, chains, annot.tx2gene, \
+            pred.tx2gene), annot.path, pred.path)
+    return score
+
+def run_script(annot, pred, pseudo, mode):
+    # score of compare_intervals_exact.pl with the prediction sorted
+    # as eval_exp2.py did before, 'error' if it fails
+    with tempfile.TemporaryDirectory() as tmp:
+        sorted_pred = '{}/pred.gtf'.format(tmp)
+        shutil.copy(pred, sorted_pred)
+        sp.call('LC_ALL=C sort -k1,1 -k4,4n -k5,5n -o {0} {0}'.format(sorted_pred), \
+            shell=True)
+        cmd = ['perl', '{}/compare_intervals_exact.pl'.format(bin), '--f1', annot, \
+            '--f2', sorted_pred, '--{}'.format(mode)]
+        if pseudo:
+            cmd += ['--pseudo', pseudo]
+        q = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE)
+    if q.returncode or q.stderr.decode():
+        return 'error'
+    out = [o.split('\t') for o in q.stdout.decode().split('\n') if o]
+    return (int(out[0][1]), int(out[0][2]), int(out[1][2]))
+
+def check(annot, pred, pseudo='', modes=modes):
+    """Compare the scores of compare with the ones of compare_intervals_exact.pl
+
+    Returns:
+        list: [mode, score, score of compare_intervals_exact.pl] for each mode
+            with different scores, a score is (tp, fn, fp) or 'error'
+    """
+    diff = []
+    for m in modes:
+        try:
+            score = compare(annot, pred, pseudo, [m])[m]
+            score = (score.tp, score.fn, score.fp)
+        except EvalError:
+            score = 'error'
+        script_score = run_script(annot, pred, pseudo, m)
+        if score != script_score:
+            diff.append([m, score, script_score])
+    return diff
+
+def main():
+    args = parseCmd()
+    if args.check:
+        diff = check(args.f1, args.f2, args.pseudo, args.modes.split(','))
+        for d in diff:
+            print('\t'.join(map(str, d)))
+        sys.stderr.write('### {} modes differ from compare_intervals_exact.pl\n'.format(\
+            len(diff)))
+        sys.exit(1 if diff else 0)
+    score = compare(args.f1, args.f2, args.pseudo, args.modes.split(','))
+    for m in modes:
+        if m not in score:
+            continue
+        print('\t'.join(map(str, [m, score[m].tp, score[m].fn, score[m].fp])))
+
+def parseCmd():
+    """Parse command line arguments
+
+    Returns:
+        dictionary: Dictionary with arguments
+    """
+    parser = argparse.ArgumentParser(description='Compare a gene prediction ' \
+        + 'to a reference annotation on CDS, transcript and gene level.')
+    parser.add_argument('--f1', type=str,
+        help='Reference annotation in gtf format')
+    parser.add_argument('--f2', type=str,
+        help='Gene prediction in gtf format')
+    parser.add_argument('--pseudo', type=str, default='',
+        help='File with pseudogene regions')
+    parser.add_argument('--modes', type=str, default=','.join(modes),
+        help='Comma separated list of the modes that are compared: cds, trans, gene')
+    parser.add_argument('--check', action='store_true',
+        help='Compare the scores with the ones of compare_intervals_exact.pl ' \
+        + 'and print the modes with different scores')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    main()
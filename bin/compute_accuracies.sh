@@ -24,9 +24,13 @@ annot=$1; shift
 pseudo="$1"; shift
 prediction="$1"; shift
 
-sortedPrediction=$(mktemp)
-
-sort -k1,1 -k4,4n -k5,5n $prediction > $sortedPrediction
+# only sort a copy of the prediction if it isn't sorted already
+if sort -c -k1,1 -k4,4n -k5,5n "$prediction" 2> /dev/null; then
+    sortedPrediction="$prediction"
+else
+    sortedPrediction=$(mktemp)
+    sort -k1,1 -k4,4n -k5,5n "$prediction" > $sortedPrediction
+fi
 
 for type in "$@"; do
     if [ $type == "start" ] || [ $type == "stop" ] || [ $type == "intron" ]; then
@@ -37,4 +41,6 @@ for type in "$@"; do
     compare $type "$flags"
 done
 
-rm $sortedPrediction
+if [ "$sortedPrediction" != "$prediction" ]; then
+    rm $sortedPrediction
+fi
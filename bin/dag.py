@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# dag.py: Run tasks with dependencies on one shared process pool,
+# a task starts as soon as all tasks it depends on are finished
+# ==============================================================
+import heapq
+import queue
+import sys
+
+class DagError(Exception):
+    pass
+
+class Task:
+    # a function call that runs in a worker of the pool after all tasks in deps
+    # finished, ready tasks with a higher priority (number or tuple) start first,
+    # memory is the estimated peak memory of the task (MB)
+    def __init__(self, name, func, args=(), deps=[], priority=0, memory=0):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.deps = list(deps)
+        self.priority = priority
+        self.memory = memory
+
+def heap_key(priority):
+    # key of a priority in the min-heap of ready tasks
+    if isinstance(priority, tuple):
+        return tuple([-p for p in priority])
+    return -priority
+
+class Graph:
+    """Dependency graph of tasks, tasks can also be added while it runs
+    (e.g. the tasks of all partitions after the partitioning finished).
+    The status of a task is 'waiting', 'ready', 'running', 'ok', 'failed'
+    or 'cancelled' (a task it depends on failed or was cancelled)
+    """
+    def __init__(self):
+        self.tasks = {}
+        self.status = {}
+        self.results = {}
+        self.dependents = {}
+        self.missing = {}
+        self.ready = []
+        self.count = 0
+
+    def add(self, task):
+        """Add a task, all tasks it depends on have to be added before
+
+        Args:
+            task (Task): new task
+
+        Raises:
+            DagError: if the name of the task exists or a dependency is missing
+        """
+        if task.name in self.tasks:
+            raise DagError('Task {} exists already.'.format(task.name))
+        for dep in task.deps:
+            if dep not in self.tasks:
+                raise DagError('Task {} depends on unknown task {}.'.format(\
+                    task.name, dep))
+        self.tasks[task.name] = task
+        self.dependents[task.name] = []
+        self.status[task.name] = 'waiting'
+        self.missing[task.name] = set()
+        for dep in task.deps:
+            self.dependents[dep].append(task.name)
+            if self.status[dep] in ['failed', 'cancelled']:
+                self.cancel(task.name)
+                return
+            if self.status[dep] != 'ok':
+                self.missing[task.name].add(dep)
+        if not self.missing[task.name]:
+            self.push(task.name)
+
+    def push(self, name):
+        # add a task to the heap of ready tasks, tasks with the same
+        # priority start in the order they became ready
+        self.status[name] = 'ready'
+        heapq.heappush(self.ready, (heap_key(self.tasks[name].priority), self.count, name))
+        self.count += 1
+
+    def cancel(self, name):
+        # cancel a task and all tasks that depend on it
+        if self.status[name] in ['cancelled', 'failed']:
+            return
+        self.status[name] = 'cancelled'
+        for dependent in self.dependents[name]:
+            self.cancel(dependent)
+
+    def finish(self, name, status, result):
+        # store the result of a task and start the tasks that only waited for it
+        self.status[name] = status
+        self.results[name] = result
+        for dependent in self.dependents[name]:
+            if status != 'ok':
+                self.cancel(dependent)
+            elif self.status[dependent] == 'waiting':
+                self.missing[dependent].discard(name)
+                if not self.missing[dependent]:
+                    self.push(dependent)
+
+    def next_task(self, free_memory, running):
+        # remove and return the ready task with the highest priority that fits
+        # into the free memory, the first task always starts if nothing runs
+        skipped = []
+        name = None
+        while self.ready:
+            item = heapq.heappop(self.ready)
+            if self.status[item[2]] != 'ready':
+                continue
+            if not running or free_memory is None \
+                or self.tasks[item[2]].memory <= free_memory:
+                name = item[2]
+                break
+            skipped.append(item)
+        for item in skipped:
+            heapq.heappush(self.ready, item)
+        return name
+
+    def run(self, pool, slots, on_done=None, memory=None):
+        """Run all tasks on a pool, at most slots tasks are submitted at the same
+        time so that the priorities decide which ready task runs next. With a memory
+        limit, a task only starts if its estimated memory fits next to the running
+        tasks, smaller tasks with a lower priority can start before it
+
+        Args:
+            pool (multiprocessing.Pool): pool of the workers
+            slots (int): number of tasks that run at the same time
+            on_done (function): on_done(name, status, result) is called in this
+                process after each task, it can add new tasks (optional)
+            memory (float): memory limit (MB) for all running tasks (optional)
+
+        Returns:
+            dictionary: status of all tasks
+        """
+        done = queue.Queue()
+        running = {}
+        while self.ready or running:
+            while len(running) < slots:
+                free_memory = None
+                if memory is not None:
+                    free_memory = memory - sum(running.values())
+                name = self.next_task(free_memory, running)
+                if name is None:
+                    break
+                self.status[name] = 'running'
+                task = self.tasks[name]
+                running[name] = task.memory
+                pool.apply_async(task.func, task.args, \
+                    callback=lambda r, n=name: done.put((n, 'ok', r)), \
+                    error_callback=lambda e, n=name: done.put((n, 'failed', e)))
+            if not running:
+                break
+            name, status, result = done.get()
+            del running[name]
+            if status == 'failed':
+                sys.stderr.write('Error in task {} with: {}\n'.format(name, result))
+            self.finish(name, status, result)
+            if on_done:
+                on_done(name, status, result)
+        return self.status
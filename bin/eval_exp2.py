@@ -6,37 +6,14 @@
 #           BRAKER1, BRAKER2, EVM, TSEBRA_EVM, TSEBRA_default
 # ==============================================================
 import argparse
-import subprocess as sp
-import multiprocessing as mp
 import os
 import itertools
 import csv
-import re
 import sys
-
-class EvalError(Exception):
-    pass
-
-class Score:
-    def __init__(self, tp, fn, fp):
-        self.tp = int(tp)
-        self.fn = int(fn)
-        self.fp = int(fp)
-
-    def sens(self):
-        if self.fn + self.tp > 0:
-            return self.tp / (self.fn + self.tp)
-        return 0
-
-    def spec(self):
-        if self.fp + self.tp > 0:
-            return self.tp / (self.fp + self.tp)
-        return 0
-
-    def f1(self):
-        if self.fn + self.tp + self.fp > 0:
-            return self.tp / (1/2 * (self.fn + self.fp) + self.tp)
-        return 0
+import checkpoint
+import executor
+from compare_intervals import Score, EvalError, Reference, compare
+from gff_utils import get_attribute
 
 workdir = ''
 partition_list = []
@@ -45,12 +22,20 @@ measures = ['F1', 'Sn', 'Sp']
 methods = ['BRAKER1', 'BRAKER2', 'EVM', 'TSEBRA_EVM', 'TSEBRA_default']
 methods_files = ['braker1.gtf', 'braker2.gtf', 'evm.gtf', 'tsebra_EVM.gtf', \
     'tsebra_default.gtf']
-part_eval_result = []
 threads = 1
+force = False
+# 'pool' or 'socket:<host>:<port>', see executor.py
+executor_spec = 'pool'
+bin = os.path.dirname(os.path.realpath(__file__))
+# worker-local cache of parsed reference annotations (exec_dir -> Reference)
+references = {}
+max_references = 4
 
 def main():
-    global workdir, partition_list, threads
+    global workdir, partition_list, threads, force, executor_spec
     args = parseCmd()
+    force = args.force
+    executor_spec = args.executor
 
     workdir = os.path.abspath('{}/EVM/{}/'.format(args.species_dir, args.test_level))
     threads = args.threads
@@ -64,9 +49,7 @@ def main():
         for p in part:
             partition_list.append(p)
 
-    eval = {}
-    for method, gene_pred in zip(methods, methods_files):
-        eval.update({method : multi_proc(gene_pred)})
+    eval = multi_proc()
 
     full_eval(eval)
 
@@ -121,47 +104,88 @@ def csv_writer(tab, out_path):
         for line in tab:
             table.writerow(line)
 
-def collector(r):
-    # collect results from multiprocessing
-    global part_eval_result
-    part_eval_result.append(r)
-
-def multi_proc(gene_pred):
-    # run evaluation in parallel
-    global part_eval_result
-
-    part_eval_result = []
-    job_results = []
-    
-    pool = mp.Pool(threads)
-    for part in partition_list:
-        r = pool.apply_async(eval_part, (part[3], gene_pred), callback=collector)
-        job_results.append(r)
-    for r in job_results:
-        r.wait()
-    pool.close()
-    pool.join()
-    results = part_eval_result
+def multi_proc():
+    # run evaluation of all (partition, method) pairs in one pool,
+    # largest partitions first so that no long job is left for the end
+    jobs = []
+    for exec_dir in sorted([p[3] for p in partition_list], key=partition_size, reverse=True):
+        for method, gene_pred in zip(methods, methods_files):
+            jobs.append((exec_dir, method, gene_pred))
+
+    total = {meth : {m : Score(0,0,0) for m in modes} for meth in methods}
+    with executor.create(executor_spec, threads, init_worker, (force,)) as ex:
+        # one chunk holds all methods of a partition, so that a worker
+        # can reuse the parsed reference annotation
+        for method, score in ex.map_unordered(eval_job, jobs, chunksize=len(methods)):
+            for m in modes:
+                total[method][m] = sum_score_lst([total[method][m], score[m]])
+    return measure_scores(total)
+
+def measure_scores(total):
+    # returns F1, Sn and Sp of the summed scores of each method and mode
     test_result = {}
-    for m in modes:
-        list = []
-        for r in part_eval_result:
-            list.append(r[m])
-        score = sum_score_lst(list)
-        test_result.update({m : {}})
-        test_result[m].update({'F1' : score.f1()})
-        test_result[m].update({'Sn' : score.sens()})
-        test_result[m].update({'Sp' : score.spec()})
+    for meth in methods:
+        test_result.update({meth : {}})
+        for m in modes:
+            score = total[meth][m]
+            test_result[meth].update({m : {}})
+            test_result[meth][m].update({'F1' : score.f1()})
+            test_result[meth][m].update({'Sn' : score.sens()})
+            test_result[meth][m].update({'Sp' : score.spec()})
     return test_result
 
+def partition_size(exec_dir):
+    # size of all files that are read for the evaluation of a partition
+    size = 0
+    for file_name in ['annot.gtf'] + methods_files:
+        path = '{}/{}'.format(exec_dir, file_name)
+        if os.path.exists(path):
+            size += os.path.getsize(path)
+    return size
+
+def init_worker(force_eval):
+    # set the options of main in a worker of the executor
+    global force
+    force = force_eval
+
+def eval_job(job):
+    exec_dir, method, gene_pred = job
+    return method, eval_pred(exec_dir, gene_pred)
+
+def get_reference(exec_dir):
+    # returns the parsed annot.gtf and pseudo.gff3 of a partition,
+    # they are read only once per worker and reused for all methods
+    if exec_dir not in references:
+        if len(references) >= max_references:
+            del references[next(iter(references))]
+        references[exec_dir] = Reference('{}/annot.gtf'.format(exec_dir), \
+            '{}/pseudo.gff3'.format(exec_dir))
+    return references[exec_dir]
+
+def eval_pred(exec_dir, gene_pred):
+    # eval the prediction of one method for one partition,
+    # the result is reused if the evaluated files didn't change
+    step = 'eval_{}'.format(gene_pred)
+    gene_pred = '{}/{}'.format(exec_dir, gene_pred)
+    key = checkpoint.input_key(['{}/annot.gtf'.format(exec_dir), \
+        '{}/pseudo.gff3'.format(exec_dir), gene_pred, \
+        '{}/compare_intervals.py'.format(bin), '{}/eval_exp2.py'.format(bin)])
+    if not force and checkpoint.is_done(exec_dir, step, key):
+        value = checkpoint.load_value(exec_dir, step)
+        return {m : Score(*value[m]) for m in modes}
+
+    score = eval_files(exec_dir, gene_pred)
+    checkpoint.mark_done(exec_dir, step, key, \
+        {m : [score[m].tp, score[m].fn, score[m].fp] for m in modes})
+    return score
 
-def eval_part(exec_dir, gene_pred):
-    # eval one partition for all test level
-    part_name = exec_dir.split('/')[-1]
+def eval_files(exec_dir, gene_pred):
+    # compare a prediction with the reference annotation of its partition
     score = {}
-    gene_pred = '{}/{}'.format(exec_dir, gene_pred)
 
-    if os.stat(gene_pred).st_size == 0:
+    if not os.path.exists(gene_pred) and not no_evm_genes(gene_pred):
+        raise EvalError('error, prediction is missing: {}\n'.format(gene_pred))
+    if not os.path.exists(gene_pred) or os.stat(gene_pred).st_size == 0:
         count = count_trans_cds('{}/annot.gtf'.format(exec_dir))
         for m in modes:
             score.update({m : Score(0,count[m],0)})
@@ -173,20 +197,19 @@ def eval_part(exec_dir, gene_pred):
             score.update({m : Score(0,0,count[m])})
         return score
 
-    cmd = 'sort -k1,1 -k4,4n -k5,5n -o {} {}'.format(gene_pred, gene_pred)
-    sp.call(cmd, shell=True)
-    for m in modes:
-        cmd = 'compare_intervals_exact.pl --f1 {}/annot.gtf --f2 {} --pseudo {}/pseudo.gff3 --{}'.format( \
-            exec_dir, gene_pred, exec_dir, m)
-        q = sp.Popen(cmd, shell=True, stdout=sp.PIPE, stderr=sp.PIPE)
-        stdout, stderr = q.communicate()
-        if stderr.decode():
-            raise EvalError(stderr.decode())
-        out = [o.split('\t') for o in stdout.decode().split('\n') if o]
-        score.update({m : Score(out[0][1], out[0][2], out[1][2])})
+    score = compare(get_reference(exec_dir), gene_pred)
 
     return score
 
+def no_evm_genes(gene_pred):
+    # check if a missing evm.gtf is the result of a completed EVM run that
+    # predicted no genes (runEVM.py writes no evm.gtf for an empty evm.out)
+    exec_dir = os.path.dirname(gene_pred)
+    evm_out = '{}/evm.out'.format(exec_dir)
+    return os.path.basename(gene_pred) == 'evm.gtf' \
+        and os.path.exists(checkpoint.marker_path(exec_dir, 'evm')) \
+        and os.path.exists(evm_out) and os.path.getsize(evm_out) == 0
+
 def sum_score_lst(list):
     score = Score(0,0,0)
     for l in list:
@@ -197,27 +220,19 @@ def sum_score_lst(list):
 
 def count_trans_cds(file_path):
     cds = 0
-    tx = []
-    gene = []
+    tx = set()
+    gene = set()
     with open(file_path, 'r') as file:
-        gtf = csv.reader(file, delimiter='\t')
-        for line in gtf:
-            if not line[2] in ['CDS', 'exon']:
+        for line in file:
+            line = line.split('\t')
+            if len(line) < 9 or not line[2] in ['CDS', 'exon']:
                 continue
-            id = get_attribute(line[8], 'transcript_id')
-            if id not in tx:
-                tx.append(id)
-            id = get_attribute(line[8], 'gene_id')
-            if id not in gene:
-                gene.append(id)
-            if line[2].lower() == 'cds':
+            tx.add(get_attribute(line[8], 'transcript_id'))
+            gene.add(get_attribute(line[8], 'gene_id'))
+            if line[2] == 'CDS':
                 cds += 1
     return {'gene' : len(gene), 'trans' : len(tx), 'cds' : cds}
 
-def get_attribute(attributes, a_name):
-    expression = a_name + '\s"([^";]+)'
-    return re.search(expression, attributes).groups()[0]
-
 def parseCmd():
     """Parse command line arguments
 
@@ -232,6 +247,11 @@ def parseCmd():
         help='Directory containing the results of TSEBRA-experiment 1 for one species.')
     parser.add_argument('--threads', type=int,
         help='')
+    parser.add_argument('--force', action='store_true',
+        help='Reevaluate all partitions, even if their files didn\'t change')
+    parser.add_argument('--executor', type=str, default='pool',
+        help='"pool" (default) or "socket:<host>:<port>" to distribute the partitions ' \
+        + 'to worker daemons started with executor.py --address <host>:<port>')
     return parser.parse_args()
 
 if __name__ == '__main__':
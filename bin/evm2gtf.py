@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# evm2gtf.py: Convert the output of EVM (evm.out) to gtf, same result
+# as EVM_to_GFF3.pl followed by gff32gtf.py
+# ==============================================================
+import argparse
+import subprocess as sp
+import tempfile
+import os
+import sys
+
+class ConversionError(Exception):
+    pass
+
+bin = os.path.dirname(os.path.realpath(__file__))
+
+def read_evm_out(path):
+    """Read the gene models of an EVM output file
+
+    Args:
+        path (str): path to evm.out
+
+    Yields:
+        list: (end5, end3) of each exon of a gene model in the order of the file
+    """
+    exons = []
+    with open(path, 'r') as file:
+        for line in file:
+            # predictions are separated by empty lines
+            if not line.strip():
+                if exons:
+                    yield exons
+                exons = []
+                continue
+            if line[0] in '#!':
+                continue
+            line = line.split('\t')
+            if len(line) < 3 or not line[0].isdigit() or not line[1].isdigit():
+                continue
+            exons.append((int(line[0]), int(line[1])))
+    if exons:
+        yield exons
+
+def gene_lines(exons, contig, model_id):
+    # returns the exon and CDS lines of a gene model in gtf format, exons in
+    # transcript order and phases from the CDS length as in Gene_obj of EVM
+    strand = '-' if any([e[0] > e[1] for e in exons]) else '+'
+    coords = sorted([sorted(e) for e in exons], reverse=(strand == '-'))
+    attributes = 'transcript_id "{}"; gene_id "{}_g";'.format(model_id, model_id)
+    lines = []
+    cds_len = 0
+    for start, end in coords:
+        phase = (3 - cds_len % 3) % 3
+        cds_len += end - start + 1
+        lines.append('\t'.join(map(str, [contig, 'EVM', 'exon', start, end, '.', strand, \
+            '.', attributes])))
+        lines.append('\t'.join(map(str, [contig, 'EVM', 'CDS', start, end, '.', strand, \
+            phase, attributes])))
+    return lines
+
+def convert(evm_out, contig, gtf_out):
+    """Convert evm.out to gtf, the gene models are named
+    'evm.model.<contig>.<n>' (transcript_id) and 'evm.model.<contig>.<n>_g' (gene_id)
+
+    Args:
+        evm_out (str): path to evm.out
+        contig (str): sequence of the predictions
+        gtf_out (str): path to the gtf output
+
+    Returns:
+        int: number of gene models
+    """
+    n = 0
+    with open(gtf_out, 'w+') as file:
+        for exons in read_evm_out(evm_out):
+            n += 1
+            model_id = 'evm.model.{}.{}'.format(contig, n)
+            file.write('\n'.join(gene_lines(exons, contig, model_id)) + '\n')
+    return n
+
+def convert_script(evm_out, contig, gtf_out, evm):
+    """Convert evm.out to gtf with EVM_to_GFF3.pl of EVM and gff32gtf.py,
+    the gff3 output is kept next to gtf_out
+
+    Args:
+        evm_out (str): path to evm.out
+        contig (str): sequence of the predictions
+        gtf_out (str): path to the gtf output
+        evm (str): path to the directory where EVM is installed
+
+    Raises:
+        ConversionError: if one of the scripts fails
+    """
+    gff_out = os.path.splitext(gtf_out)[0] + '.gff'
+    for cmd in ['{}/EvmUtils/EVM_to_GFF3.pl {} {} > {}'.format(evm, evm_out, contig, gff_out), \
+        'python3 {}/gff32gtf.py --gff {} --out {}'.format(bin, gff_out, gtf_out)]:
+        q = sp.run(cmd, shell=True, stderr=sp.PIPE, universal_newlines=True)
+        if q.returncode != 0:
+            raise ConversionError('Error in {} with exit code {}: {}'.format(cmd, \
+                q.returncode, q.stderr))
+
+def check(evm_out, contig, evm):
+    """Compare the gtf of convert with the one of EVM_to_GFF3.pl and gff32gtf.py,
+    the lines are compared regardless of their order
+
+    Returns:
+        list: lines that are only in one of both outputs, with the prefix
+            'native' or 'script'
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        convert(evm_out, contig, '{}/native.gtf'.format(tmp))
+        convert_script(evm_out, contig, '{}/script.gtf'.format(tmp), evm)
+        lines = {}
+        for name in ['native', 'script']:
+            with open('{}/{}.gtf'.format(tmp, name), 'r') as file:
+                lines[name] = sorted([l.rstrip('\n') for l in file if l.strip()])
+    diff = ['native\t' + l for l in lines['native'] if l not in set(lines['script'])] \
+        + ['script\t' + l for l in lines['script'] if l not in set(lines['native'])]
+    return diff
+
+def main():
+    args = parseCmd()
+    if args.check:
+        diff = check(args.evm_out, args.contig, args.evm_path)
+        for line in diff:
+            print(line)
+        sys.stderr.write('### {} lines differ from EVM_to_GFF3.pl\n'.format(len(diff)))
+        sys.exit(1 if diff else 0)
+    if args.evm_script:
+        convert_script(args.evm_out, args.contig, args.out, args.evm_path)
+    else:
+        convert(args.evm_out, args.contig, args.out)
+
+def parseCmd():
+    """Parse command line arguments
+
+    Returns:
+        dictionary: Dictionary with arguments
+    """
+    parser = argparse.ArgumentParser(description='Convert the output of EVM to gtf')
+    parser.add_argument('--evm_out', type=str,
+        help='Output of evidence_modeler.pl')
+    parser.add_argument('--contig', type=str,
+        help='Sequence of the predictions')
+    parser.add_argument('--out', type=str,
+        help='Output in gtf format')
+    parser.add_argument('--evm_path', type=str,
+        help='Path to the directory where EVidenceModeler is installed ' \
+        + '(only for --evm_script and --check)')
+    parser.add_argument('--evm_script', action='store_true',
+        help='Convert with EVM_to_GFF3.pl and gff32gtf.py instead of the native conversion')
+    parser.add_argument('--check', action='store_true',
+        help='Compare the native conversion with EVM_to_GFF3.pl and print the ' \
+        + 'lines that differ')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    main()
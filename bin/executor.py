@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# executor.py: Run the jobs of the partitions on a local process pool or
+# distribute them over a socket to worker daemons on several nodes
+# ==============================================================
+import argparse
+import multiprocessing as mp
+from multiprocessing.connection import Listener, Client, wait
+import collections
+import importlib
+import threading
+import socket
+import queue
+import time
+import os
+import sys
+import job_runner
+
+class ExecutorError(Exception):
+    pass
+
+class TaskError(Exception):
+    pass
+
+# environment variable with the key that workers and coordinator share
+authkey_env = 'EXECUTOR_AUTHKEY'
+# number of tasks a worker holds in its queue in addition to the running ones
+prefetch = 1
+# seconds between two attempts of a worker to connect to the coordinator
+retry_delay = 2
+
+def create(spec, threads=1, initializer=None, initargs=()):
+    """Create an executor
+
+    Args:
+        spec (str): 'pool' for a local process pool or 'socket:<host>:<port>' for
+            worker daemons that connect to this address (executor.py --address <host>:<port>)
+        threads (int): number of processes of the local pool
+        initializer (function): initializer(*initargs) is called in each worker process,
+            e.g. to set the options of a script (optional)
+        initargs (tuple): arguments of initializer
+
+    Returns:
+        PoolExecutor or SocketExecutor
+    """
+    if not spec or spec == 'pool':
+        return PoolExecutor(threads, initializer, initargs)
+    if spec.startswith('socket:'):
+        return SocketExecutor(parse_address(spec[7:]), initializer, initargs)
+    raise ExecutorError('Unknown executor {}, use "pool" or "socket:<host>:<port>".'.format(spec))
+
+def parse_address(address):
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+def get_authkey():
+    if not os.environ.get(authkey_env):
+        raise ExecutorError('Set the same key in ${} for the coordinator and '.format(\
+            authkey_env) + 'all workers.')
+    return os.environ[authkey_env].encode()
+
+def func_ref(func):
+    # reference of a module-level function that can be imported by a worker,
+    # functions of a script are imported from the module of the script
+    module = func.__module__
+    if module == '__main__':
+        module = os.path.splitext(os.path.basename(sys.modules['__main__'].__file__))[0]
+    return module, func.__name__
+
+def resolve(ref):
+    module, name = ref
+    return getattr(importlib.import_module(module), name)
+
+def run_chunk(ref, jobs):
+    # run the jobs of one task in a worker process
+    func = resolve(ref)
+    return [func(job) for job in jobs]
+
+def init_process(ref, initargs):
+    if ref:
+        resolve(ref)(*initargs)
+
+class PoolExecutor:
+    # run jobs on a local multiprocessing.Pool
+    def __init__(self, threads, initializer=None, initargs=()):
+        self.pool = mp.Pool(threads, initializer, initargs)
+
+    def map_unordered(self, func, jobs, chunksize=1):
+        """Run func for all jobs
+
+        Args:
+            func (function): module-level function with one argument
+            jobs (list): arguments of func
+            chunksize (int): number of consecutive jobs that run in the same process
+
+        Yields:
+            object: results in the order in which the jobs finish
+        """
+        return self.pool.imap_unordered(func, jobs, chunksize=chunksize)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SocketExecutor:
+    """Distribute jobs to worker daemons that connect to a socket. A worker
+    gets tasks up to the number of its processes plus prefetch, and a worker
+    with free processes takes queued tasks from the most loaded worker if no
+    other tasks are left. Results are returned as soon as they arrive, the tasks
+    of a worker that disconnects are given to the other workers.
+    """
+    def __init__(self, address, initializer=None, initargs=()):
+        self.init = (func_ref(initializer) if initializer else None, initargs)
+        self.listener = Listener(address, authkey=get_authkey())
+        self.workers = {}
+        self.failed = {}
+        self.new_workers = []
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self.accept, daemon=True)
+        thread.start()
+        sys.stderr.write('### Waiting for workers at {}:{}\n'.format(*self.listener.address))
+
+    def accept(self):
+        # accept connections of workers and send them the initializer
+        while True:
+            try:
+                conn = self.listener.accept()
+                msg, slots, host = conn.recv()
+                conn.send(('init', self.init[0], self.init[1]))
+            except mp.AuthenticationError:
+                sys.stderr.write('### Rejected a worker with a wrong key\n')
+                continue
+            except (OSError, EOFError):
+                if self.listener is None:
+                    return
+                continue
+            with self.lock:
+                self.new_workers.append((conn, slots, host))
+
+    def add_workers(self):
+        with self.lock:
+            new, self.new_workers = self.new_workers, []
+        for conn, slots, host in new:
+            self.workers[conn] = {'slots' : slots, 'host' : host, 'tasks' : set(), \
+                'steal' : False}
+            sys.stderr.write('### Worker {} connected with {} processes\n'.format(host, slots))
+
+    def map_unordered(self, func, jobs, chunksize=1):
+        """Run func for all jobs on the workers
+
+        Args:
+            func (function): module-level function with one argument
+            jobs (list): arguments of func
+            chunksize (int): number of consecutive jobs that run in the same process
+
+        Yields:
+            object: results in the order in which the jobs finish
+        """
+        ref = func_ref(func)
+        jobs = list(jobs)
+        tasks = {}
+        for i in range(0, len(jobs), chunksize):
+            tasks[len(tasks)] = jobs[i:i+chunksize]
+        pending = collections.deque(tasks.keys())
+        remaining = len(tasks)
+        while remaining:
+            self.add_workers()
+            # give pending tasks to the workers with the fewest tasks
+            for conn, w in sorted(self.workers.items(), key=lambda x:len(x[1]['tasks'])):
+                while pending and len(w['tasks']) < w['slots'] + prefetch:
+                    task = pending.popleft()
+                    w['tasks'].add(task)
+                    conn.send(('task', task, ref, tasks[task]))
+            # idle processes: take a queued task of the most loaded worker
+            if not pending:
+                idle = [w for w in self.workers.values() if len(w['tasks']) < w['slots']]
+                loaded = [(len(w['tasks']) - w['slots'], conn) for conn, w in \
+                    self.workers.items() if len(w['tasks']) > w['slots'] and not w['steal']]
+                if idle and loaded:
+                    conn = max(loaded, key=lambda x:x[0])[1]
+                    self.workers[conn]['steal'] = True
+                    conn.send(('steal',))
+
+            for conn in wait(list(self.workers.keys()), timeout=1):
+                w = self.workers[conn]
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    # worker is gone, its tasks are run by the other workers
+                    sys.stderr.write('### Worker {} disconnected, {} tasks are rescheduled\n'.format(\
+                        w['host'], len(w['tasks'])))
+                    pending.extend(sorted(w['tasks']))
+                    del self.workers[conn]
+                    continue
+                if msg[0] == 'result':
+                    task, ok, value = msg[1:]
+                    if task not in w['tasks']:
+                        continue
+                    w['tasks'].remove(task)
+                    remaining -= 1
+                    if not ok:
+                        raise TaskError(value)
+                    for result in value:
+                        yield result
+                elif msg[0] == 'failed':
+                    # initializer failed on the worker, it gets no more tasks
+                    sys.stderr.write('### Initialization failed on worker {} with: {}\n'.format(\
+                        w['host'], msg[1]))
+                    pending.extend(sorted(w['tasks']))
+                    self.failed[conn] = msg[1]
+                    del self.workers[conn]
+                    if not self.workers:
+                        raise ExecutorError('Initialization failed on all workers: {}'.format(\
+                            msg[1]))
+                elif msg[0] == 'stolen':
+                    w['steal'] = False
+                    if msg[1] is not None and msg[1] in w['tasks']:
+                        w['tasks'].remove(msg[1])
+                        pending.appendleft(msg[1])
+            if not self.workers:
+                time.sleep(0.5)
+
+    def close(self):
+        # stop the work of all workers, the daemons wait for the next coordinator
+        self.add_workers()
+        for conn in list(self.workers) + list(self.failed):
+            try:
+                conn.send(('stop',))
+                conn.close()
+            except OSError:
+                pass
+        self.workers = {}
+        self.failed = {}
+        listener, self.listener = self.listener, None
+        listener.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def connect(address):
+    # connect to a coordinator, retries until it is available, a wrong
+    # key raises multiprocessing.AuthenticationError
+    while True:
+        try:
+            return Client(address, authkey=get_authkey())
+        except (EOFError, OSError):
+            # coordinator isn't running or stopped during the authentication
+            time.sleep(retry_delay)
+
+def serve(conn, threads):
+    """Run the tasks of a coordinator with a local pool until it stops,
+    tasks that didn't start are returned to the coordinator on request
+
+    Args:
+        conn (Connection): connection to the coordinator
+        threads (int): number of processes
+    """
+    try:
+        conn.send(('hello', threads, socket.gethostname()))
+        msg, init, initargs = conn.recv()
+    except (EOFError, OSError):
+        # coordinator stopped during the handshake
+        return
+    # initialize once before the fork, the processes of the pool inherit it
+    # (an initializer that fails in the pool would restart its processes forever)
+    try:
+        init_process(init, initargs)
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+        sys.stderr.write('### Initialization failed with: {}\n'.format(error))
+        try:
+            # the coordinator sends no more tasks, wait until it stops
+            conn.send(('failed', error))
+            while conn.recv()[0] != 'stop':
+                pass
+        except (EOFError, OSError):
+            pass
+        return
+    results = queue.Queue()
+    queued = collections.deque()
+    running = 0
+    # the processes of the pool kill the process groups of their
+    # commands (e.g. EVM) if the pool is terminated
+    with mp.Pool(threads, job_runner.kill_on_term) as pool:
+        try:
+            while True:
+                while queued and running < threads:
+                    task, ref, jobs = queued.popleft()
+                    pool.apply_async(run_chunk, (ref, jobs), \
+                        callback=lambda r, t=task: results.put((t, True, r)), \
+                        error_callback=lambda e, t=task: results.put((t, False, \
+                        '{}: {}'.format(type(e).__name__, e))))
+                    running += 1
+                while not results.empty():
+                    conn.send(('result',) + results.get())
+                    running -= 1
+                if not conn.poll(0.05):
+                    continue
+                msg = conn.recv()
+                if msg[0] == 'task':
+                    queued.append(msg[1:])
+                elif msg[0] == 'steal':
+                    conn.send(('stolen', queued.pop()[0] if queued else None))
+                elif msg[0] == 'stop':
+                    break
+        except (EOFError, OSError):
+            pass
+        pool.terminate()
+
+def main():
+    args = parseCmd()
+    address = parse_address(args.address)
+    while True:
+        conn = connect(address)
+        sys.stderr.write('### Connected to {}:{}\n'.format(*address))
+        serve(conn, args.threads)
+        conn.close()
+        if args.once:
+            break
+
+def parseCmd():
+    """Parse command line arguments
+
+    Returns:
+        dictionary: Dictionary with arguments
+    """
+    parser = argparse.ArgumentParser(description='Worker daemon that runs the jobs ' \
+        + 'of runEVM.py, runTSEBRA.py or eval_exp2.py started with ' \
+        + '--executor socket:<host>:<port>. Set the same key in $EXECUTOR_AUTHKEY ' \
+        + 'for the coordinator and all workers.')
+    parser.add_argument('--address', type=str,
+        help='Address of the coordinator: <host>:<port>')
+    parser.add_argument('--threads', type=int, default=1,
+        help='Number of processes of the worker')
+    parser.add_argument('--once', action='store_true',
+        help='Exit after the first coordinator finished instead of waiting for the next one')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    main()
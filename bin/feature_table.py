@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# feature_table.py: Columnar NumPy representation of gtf/gff3 features
+# ==============================================================
+import array
+import numpy as np
+from gff_utils import read_gff
+
+class Vocabulary:
+    # maps strings (e.g. seqids) to integer codes, tables that
+    # are compared with each other have to share their vocabularies
+
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+
+    def code(self, name):
+        if name not in self.codes:
+            self.codes[name] = len(self.names)
+            self.names.append(name)
+        return self.codes[name]
+
+    def __getitem__(self, code):
+        return self.names[code]
+
+    def __len__(self):
+        return len(self.names)
+
+class FeatureTable:
+    """Columnar table of gtf/gff3 features.
+
+    seqid, type, transcript and gene ID of a feature are stored as codes of
+    the vocabularies seqids, types, tx_ids and gene_ids (-1 if a feature has
+    no transcript or gene ID), strand as 1 ('+'), -1 ('-') or 0 ('.') and
+    phase as 0, 1, 2 or -1 ('.').
+    """
+    columns = ['seqid', 'type', 'strand', 'start', 'end', 'phase', 'tx', 'gene']
+
+    def __init__(self, seqids=None, types=None, tx_ids=None, gene_ids=None):
+        self.seqids = seqids if seqids is not None else Vocabulary()
+        self.types = types if types is not None else Vocabulary()
+        self.tx_ids = tx_ids if tx_ids is not None else Vocabulary()
+        self.gene_ids = gene_ids if gene_ids is not None else Vocabulary()
+        for col in self.columns:
+            setattr(self, col, np.zeros(0, dtype=np.int64))
+
+    @classmethod
+    def from_gff(cls, path, types=None, tx_attr='transcript_id', \
+        gene_attr='gene_id', seqids=None):
+        """Load features from a gtf/gff3 file
+
+        Args:
+            path (str): path to gtf/gff3 file
+            types (list): only load features of these types (optional)
+            tx_attr (str): attribute with the transcript ID, e.g. 'Parent' for gff3
+            gene_attr (str): attribute with the gene ID
+            seqids (Vocabulary): seqid vocabulary shared with other tables (optional)
+
+        Returns:
+            FeatureTable: table with one row for each feature
+        """
+        table = cls(seqids=seqids)
+        cols = {col : array.array('q') for col in cls.columns}
+        strand_code = {'+' : 1, '-' : -1}
+        for feature in read_gff(path, types):
+            cols['seqid'].append(table.seqids.code(feature.seqid))
+            cols['type'].append(table.types.code(feature.type))
+            cols['strand'].append(strand_code.get(feature.strand, 0))
+            cols['start'].append(feature.start)
+            cols['end'].append(feature.end)
+            cols['phase'].append(int(feature.phase) if feature.phase in '012' \
+                and feature.phase else -1)
+            tx_id = feature.get(tx_attr)
+            cols['tx'].append(table.tx_ids.code(tx_id) if tx_id is not None else -1)
+            gene_id = feature.get(gene_attr)
+            cols['gene'].append(table.gene_ids.code(gene_id) if gene_id is not None else -1)
+        for col in cls.columns:
+            setattr(table, col, np.frombuffer(cols[col], dtype=np.int64).copy())
+        return table
+
+    def __len__(self):
+        return len(self.start)
+
+    def take(self, index):
+        # returns a new table with the rows selected by index (mask or indices)
+        table = FeatureTable(self.seqids, self.types, self.tx_ids, self.gene_ids)
+        for col in self.columns:
+            setattr(table, col, getattr(self, col)[index])
+        return table
+
+    def of_type(self, *names):
+        # returns all features of the given types
+        codes = [self.types.codes[n] for n in names if n in self.types.codes]
+        return self.take(np.isin(self.type, codes))
+
+    def sort(self):
+        # sort by seqid, start and end (same order as 'sort -k1,1 -k4,4n -k5,5n'
+        # if the seqid codes were assigned in sorted order)
+        return self.take(np.lexsort((self.end, self.start, self.seqid)))
+
+    def sort_by_tx(self):
+        # sort by transcript and start
+        return self.take(np.lexsort((self.end, self.start, self.tx)))
+
+    def group_bounds(self, col='tx'):
+        # returns the start indices of all groups of consecutive rows with
+        # the same value in col and len(self) as last element
+        values = getattr(self, col)
+        if not len(values):
+            return np.zeros(1, dtype=np.int64)
+        change = np.flatnonzero(values[1:] != values[:-1]) + 1
+        return np.concatenate(([0], change, [len(values)]))
+
+    def groups(self, col='tx'):
+        # yields (value, table) for each group of a table sorted by col
+        bounds = self.group_bounds(col)
+        values = getattr(self, col)
+        for i in range(len(bounds) - 1):
+            yield values[bounds[i]], self.take(slice(bounds[i], bounds[i+1]))
+
+    def merge_gaps(self, max_gap=3):
+        """Merge consecutive features of a transcript that are separated by
+        less than max_gap bases (the table has to be sorted by transcript and
+        start). As in the hint scripts, the end of a merged feature is the
+        end of its last part.
+
+        Returns:
+            FeatureTable: table with merged features
+        """
+        if not len(self):
+            return self.take(slice(0, 0))
+        new_run = np.ones(len(self), dtype=bool)
+        new_run[1:] = (self.tx[1:] != self.tx[:-1]) \
+            | (self.start[1:] - self.end[:-1] >= max_gap)
+        first = np.flatnonzero(new_run)
+        last = np.concatenate((first[1:], [len(self)])) - 1
+        table = self.take(first)
+        table.end = self.end[last]
+        return table
+
+    def introns(self):
+        """Derive introns between consecutive features of the same transcript
+        (the table has to be sorted by transcript and start).
+
+        Returns:
+            FeatureTable: table with one 'intron' row for each intron
+        """
+        same_tx = (self.tx[1:] == self.tx[:-1]) & (self.tx[1:] >= 0)
+        index = np.flatnonzero(same_tx)
+        table = self.take(index)
+        table.start = self.end[index] + 1
+        table.end = self.start[index + 1] - 1
+        table.phase = np.full(len(table), -1, dtype=np.int64)
+        table.type = np.full(len(table), self.types.code('intron'), dtype=np.int64)
+        return table
+
+    def keys(self, phase=True):
+        # returns a structured array with the exact match key of each row
+        fields = [('seqid', np.int64), ('start', np.int64), ('end', np.int64), \
+            ('strand', np.int64)]
+        if phase:
+            fields.append(('phase', np.int64))
+        keys = np.zeros(len(self), dtype=fields)
+        for name, dtype in fields:
+            keys[name] = getattr(self, name)
+        return keys
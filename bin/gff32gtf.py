@@ -5,19 +5,15 @@
 # gff32gtf.py: Convert gff3 to gtf
 # ==============================================================
 import argparse
+from gff_utils import read_gff
 
 def main():
     result = []
     args = parseCmd()
-    with open(args.gff, 'r') as file:
-        for line in file.readlines():
-            line = line.split('\t')
-            if len(line) == 9:
-                if line[2] not in ['CDS', 'exon']:
-                    continue
-                id = line[8].split('Parent=')[1].strip('\n')
-                line[8] = 'transcript_id "{}"; gene_id "{}_g";\n'.format(id, id)
-                result.append('\t'.join(line))
+    for feature in read_gff(args.gff, types=['CDS', 'exon']):
+        id = feature.get('Parent')
+        feature.attributes = 'transcript_id "{}"; gene_id "{}_g";'.format(id, id)
+        result.append(feature.line() + '\n')
     with open(args.out, 'w+') as file:
         file.write(''.join(result))
 
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# gff_index.py: Create an interval index for a gtf/gff3 file and
+# retrieve all features of a region from it
+# ==============================================================
+import argparse
+import array
+import bisect
+import json
+import os
+import sys
+import tempfile
+
+# index file layout: one json header line with the size and mtime of the
+# indexed file and for each seqid the number of features, their maximal
+# length and the position of its block, followed by the blocks.
+# A block holds the arrays start, end and file offset (int64) of all
+# features of a seqid, sorted by start.
+
+class RegionError(Exception):
+    pass
+
+def index_path(path):
+    return path + '.idx'
+
+def build_index(path):
+    """Create the index '<path>.idx' for a gtf/gff3 file
+
+    Args:
+        path (str): path to gtf/gff3 file
+    """
+    features = {}
+    offset = 0
+    with open(path, 'rb') as file:
+        for line in file:
+            line_offset = offset
+            offset += len(line)
+            if line.startswith(b'#'):
+                continue
+            columns = line.split(b'\t', 5)
+            if len(columns) < 5:
+                continue
+            seqid = columns[0].decode()
+            if seqid not in features:
+                features[seqid] = []
+            features[seqid].append((int(columns[3]), int(columns[4]), line_offset))
+
+    header = {'size' : os.path.getsize(path), 'mtime' : os.path.getmtime(path), \
+        'seqids' : {}}
+    blocks = []
+    position = 0
+    for seqid, coords in features.items():
+        coords.sort()
+        block = array.array('q', [c[0] for c in coords] + [c[1] for c in coords] \
+            + [c[2] for c in coords])
+        header['seqids'][seqid] = {'count' : len(coords), 'position' : position, \
+            'max_len' : max([c[1] - c[0] for c in coords])}
+        position += len(block) * block.itemsize
+        blocks.append(block)
+
+    # unique temporary file, processes that index the same file at the
+    # same time don't write into each other's index
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)), \
+        prefix=os.path.basename(index_path(path)) + '.', delete=False) as file:
+        try:
+            file.write(json.dumps(header).encode() + b'\n')
+            for block in blocks:
+                block.tofile(file)
+        except BaseException:
+            os.remove(file.name)
+            raise
+    os.replace(file.name, index_path(path))
+
+def read_header(path):
+    # returns the header of an index and its length in bytes
+    with open(index_path(path), 'rb') as file:
+        line = file.readline()
+    return json.loads(line), len(line)
+
+def is_current(path):
+    # check if the index of a file exists and is up to date
+    if not os.path.exists(index_path(path)):
+        return False
+    header, length = read_header(path)
+    return header['size'] == os.path.getsize(path) \
+        and header['mtime'] == os.path.getmtime(path)
+
+def fetch(path, seqid, start, end, adjust=False, overlap=False):
+    """Retrieve all features of a region, the index is created if it is
+    missing or older than the file
+
+    Args:
+        path (str): path to gtf/gff3 file
+        seqid (str): sequence of the region
+        start (int): start of the region
+        end (int): end of the region
+        adjust (bool): adjust coordinates to the start of the region
+            (ADJUST_TO_ONE of gff_range_retriever.pl)
+        overlap (bool): return all features that overlap the region
+            instead of only those that are contained in it
+
+    Returns:
+        list: lines (without newline) sorted by start, end and line
+    """
+    if not is_current(path):
+        build_index(path)
+    header, length = read_header(path)
+    if seqid not in header['seqids']:
+        return []
+    info = header['seqids'][seqid]
+    count = info['count']
+    block = array.array('q')
+    with open(index_path(path), 'rb') as file:
+        file.seek(length + info['position'])
+        block.fromfile(file, 3 * count)
+    starts = block[:count]
+
+    # features that start in [start - max_len, end]
+    first = bisect.bisect_left(starts, start - info['max_len'])
+    last = bisect.bisect_right(starts, end)
+    result = []
+    with open(path, 'rb') as file:
+        for i in range(first, last):
+            f_start, f_end = starts[i], block[count + i]
+            if overlap:
+                if f_end < start:
+                    continue
+            elif f_start < start or f_end > end:
+                continue
+            file.seek(block[2 * count + i])
+            line = file.readline().decode().rstrip('\n').split('\t')
+            if adjust:
+                line[3] = str(f_start - start + 1)
+                line[4] = str(f_end - start + 1)
+            result.append((f_start, f_end, '\t'.join(line)))
+    result.sort()
+    return [r[2] for r in result]
+
+def parse_region(region):
+    # parse 'seqid:start-end'
+    seqid, coords = region.rsplit(':', 1)
+    start, end = coords.split('-')
+    return seqid, int(start.replace(',', '')), int(end.replace(',', ''))
+
+def main():
+    args = parseCmd()
+    if args.build:
+        for path in args.gff:
+            build_index(path)
+        return
+    if not args.region:
+        raise RegionError('Provide a region with --region or use --build.')
+    seqid, start, end = parse_region(args.region)
+    for path in args.gff:
+        for line in fetch(path, seqid, start, end, args.adjust, args.overlap):
+            sys.stdout.write(line + '\n')
+
+def parseCmd():
+    """Parse command line arguments
+
+    Returns:
+        dictionary: Dictionary with arguments
+    """
+    parser = argparse.ArgumentParser(description='Create an interval index ' \
+        + 'for gtf/gff3 files and retrieve all features of a region.')
+    parser.add_argument('--gff', type=str, nargs='+',
+        help='One or more files in gtf/gff3 format')
+    parser.add_argument('--build', action='store_true',
+        help='Only create (or update) the index of the files')
+    parser.add_argument('--region', type=str,
+        help='Region in the format seqid:start-end')
+    parser.add_argument('--adjust', action='store_true',
+        help='Adjust coordinates to the start of the region')
+    parser.add_argument('--overlap', action='store_true',
+        help='Retrieve all features overlapping the region instead of ' \
+        + 'only the features contained in it')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    main()
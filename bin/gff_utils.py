@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# gff_utils.py: Shared helpers for reading gtf/gff3 files
+# ==============================================================
+import re
+
+# compiled expressions for gtf attributes, e.g. 'transcript_id "g1.t1";'
+gtf_attr_exp = {}
+
+class Feature:
+    # one line of a gtf/gff3 file, the attributes
+    # are only decoded when they are accessed
+
+    __slots__ = ('seqid', 'source', 'type', 'start', 'end', 'score', \
+        'strand', 'phase', 'attributes', '_attr')
+
+    def __init__(self, columns):
+        self.seqid, self.source, self.type = columns[:3]
+        self.start = int(columns[3])
+        self.end = int(columns[4])
+        self.score, self.strand, self.phase, self.attributes = columns[5:]
+        self._attr = None
+
+    def get(self, name):
+        # returns the value of an attribute or None if it is missing
+        if self._attr is None:
+            self._attr = decode_attributes(self.attributes)
+        return self._attr.get(name)
+
+    def to_list(self):
+        return [self.seqid, self.source, self.type, self.start, self.end, \
+            self.score, self.strand, self.phase, self.attributes]
+
+    def line(self):
+        # returns the feature as a line without newline
+        return '\t'.join(map(str, self.to_list()))
+
+def read_gff(path, types=None):
+    """Read a gtf/gff3 file line by line
+
+    Args:
+        path (str): path to gtf/gff3 file
+        types (list): only features of these types are returned (optional)
+
+    Yields:
+        Feature: feature for each line with 9 columns
+    """
+    if types is not None:
+        types = set(types)
+    with open(path, 'r') as file:
+        for line in file:
+            columns = line.rstrip('\n').split('\t')
+            if len(columns) != 9:
+                continue
+            if types is not None and columns[2] not in types:
+                continue
+            yield Feature(columns)
+
+def decode_attributes(attributes):
+    # decode gtf ('key "value";') or gff3 ('key=value;') attributes,
+    # the first value of a key is kept
+    result = {}
+    for field in attributes.split(';'):
+        field = field.strip()
+        if not field:
+            continue
+        key, sep, value = field.partition('=')
+        if not sep or ' ' in key:
+            key, sep, value = field.partition(' ')
+            value = value.strip().strip('"')
+        if key not in result:
+            result[key] = value
+    return result
+
+def get_attribute(attributes, a_name):
+    # returns the value of a gtf attribute or None if it is missing
+    if a_name not in gtf_attr_exp:
+        gtf_attr_exp[a_name] = re.compile(r'(?:^|[\s;]){}\s"([^";]+)'.format(re.escape(a_name)))
+    match = gtf_attr_exp[a_name].search(attributes)
+    if match:
+        return match.group(1)
+    return None
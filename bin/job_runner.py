@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# job_runner.py: Run the job of a partition with a timeout and
+# retries, and report its status, runtime and peak memory
+# ==============================================================
+import subprocess as sp
+import tempfile
+import resource
+import signal
+import json
+import math
+import time
+import os
+
+class JobTimeout(Exception):
+    pass
+
+# seconds between SIGTERM and SIGKILL for a job that timed out
+kill_delay = 5
+# process groups of the commands that run in this process
+running_groups = set()
+
+def run_cmd(cmd, timeout=None, retries=0):
+    """Run a shell command in its own process group, the whole group is
+    killed if the command doesn't finish in time
+
+    Args:
+        cmd (str): shell command (its stdout is discarded)
+        timeout (float): timeout of an attempt in seconds (optional)
+        retries (int): number of retries after a failed attempt
+
+    Returns:
+        dictionary: report with status ('ok', 'failed' or 'timeout'), exit_code,
+            runtime (s), peak_rss (kB) and attempts of the last attempt
+        str: stderr of the last attempt
+    """
+    for attempt in range(1, retries + 2):
+        start = time.time()
+        with tempfile.TemporaryFile() as err:
+            q = sp.Popen(cmd, shell=True, stdout=sp.DEVNULL, stderr=err, \
+                start_new_session=True)
+            running_groups.add(q.pid)
+            status = 'ok'
+            wait_status, rusage = wait(q.pid, timeout)
+            if wait_status is None:
+                status = 'timeout'
+                wait_status, rusage = kill_group(q.pid)
+            running_groups.discard(q.pid)
+            # the process was reaped with wait4, Popen mustn't wait for it
+            q.returncode = exit_code(wait_status)
+            err.seek(0)
+            stderr = err.read().decode(errors='replace')
+        if status == 'ok' and q.returncode != 0:
+            status = 'failed'
+        report = {'status' : status, 'exit_code' : q.returncode, \
+            'runtime' : round(time.time() - start, 2), 'peak_rss' : rusage.ru_maxrss, \
+            'attempts' : attempt}
+        if status == 'ok':
+            break
+    return report, stderr
+
+def wait(pid, timeout=None):
+    # wait for a child process, returns its wait status and resource usage
+    # (including its reaped children) or (None, None) after a timeout
+    start = time.time()
+    interval = 0.01
+    while True:
+        done, wait_status, rusage = os.wait4(pid, os.WNOHANG)
+        if done:
+            return wait_status, rusage
+        if timeout and time.time() - start > timeout:
+            return None, None
+        time.sleep(interval)
+        interval = min(2 * interval, 0.5)
+
+def kill_group(pid):
+    # terminate the process group of a child, it is killed if
+    # it doesn't stop after kill_delay seconds
+    try:
+        os.killpg(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    wait_status, rusage = wait(pid, kill_delay)
+    if wait_status is None:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        wait_status, rusage = wait(pid)
+    return wait_status, rusage
+
+def kill_on_term():
+    # kill the process groups of all running commands if this process
+    # is terminated (e.g. a worker of a pool), they would be orphaned otherwise
+    signal.signal(signal.SIGTERM, terminate)
+
+def terminate(signum, frame):
+    for pid in list(running_groups):
+        kill_group(pid)
+    os._exit(128 + signum)
+
+def exit_code(wait_status):
+    # exit code of a process, -signal if it was killed
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+def alarm(signum, frame):
+    raise JobTimeout()
+
+def run_function(func, args=(), timeout=None, retries=0):
+    """Call a function with a timeout (SIGALRM, only from the main thread
+    of a process, e.g. in a worker of multiprocessing.Pool)
+
+    Args:
+        func (function): function of the job
+        args (tuple): arguments of func
+        timeout (float): timeout of an attempt in seconds (optional)
+        retries (int): number of retries after a failed attempt
+
+    Returns:
+        object: return value of func, None if all attempts failed
+        dictionary: report as in run_cmd, exit_code is 0 or None and peak_rss
+            is the peak memory of the calling process
+        str: error of the last attempt
+    """
+    result = None
+    for attempt in range(1, retries + 2):
+        start = time.time()
+        status = 'ok'
+        error = ''
+        if timeout:
+            signal.signal(signal.SIGALRM, alarm)
+            signal.alarm(math.ceil(timeout))
+        try:
+            result = func(*args)
+        except JobTimeout:
+            status = 'timeout'
+        except Exception as e:
+            status = 'failed'
+            error = str(e)
+        finally:
+            if timeout:
+                signal.alarm(0)
+        report = {'status' : status, 'exit_code' : 0 if status == 'ok' else None, \
+            'runtime' : round(time.time() - start, 2), \
+            'peak_rss' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, \
+            'attempts' : attempt}
+        if status == 'ok':
+            break
+    return result, report, error
+
+def write_manifest(reports, path):
+    """Write the reports of all partitions to a json file
+
+    Args:
+        reports (list): report dictionary of each partition with the key 'partition'
+        path (str): path of the manifest
+
+    Returns:
+        list: reports of the partitions that didn't finish
+    """
+    with open(path + '.tmp', 'w+') as file:
+        json.dump(reports, file, indent=1)
+    os.replace(path + '.tmp', path)
+    return [r for r in reports if r['status'] not in ['ok', 'skipped']]
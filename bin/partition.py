@@ -11,6 +11,10 @@ import csv
 import os
 import multiprocessing as mp
 import sys
+import bisect
+import gff_index
+import prot_store
+import checkpoint
 
 class FileMissing(Exception):
     pass
@@ -21,15 +25,22 @@ mode = ''
 evm = ''
 bin_dir = os.path.abspath(os.path.dirname(__file__))
 workdir = ''
+force = False
+# files for TSEBRA runs and evaluation in each partition
+file_name = ['braker1.gtf', 'braker2.gtf', 'annot.gtf', 'pseudo.gff3', 'tsebra_default.gtf']
+# hints for EVM and TSEBRA, they are created for the whole genome and then split,
+# the alignments in evm_*.gff stay complete
+hint_name = ['braker_pasa.gff', 'evm_pasa.gff', 'braker_protein.gff', 'evm_protein.gff']
+hint_group = [False, True, False, True]
 
 def main():
-    global workdir, mode, evm
+    global workdir, mode, evm, force
 
     args = parseCmd()
+    force = args.force
 
     mode = args.test_level
     workdir = make_abs(args.out)
-    evm = make_abs(args.evm_path)
     data_dir = make_abs(args.species_dir)
     braker1 = make_abs('{}/braker1/braker_fixed.gtf'.format(data_dir))
     braker2 = make_abs('{}/braker2/{}/braker_fixed.gtf'.format(data_dir, mode))
@@ -39,7 +50,13 @@ def main():
     pasa = make_abs('{}/pasa/sample_mydb_pasa.sqlite.pasa_assemblies.gff3'.format(data_dir))
     genome = make_abs('{}/data/genome.fasta.masked'.format(data_dir))
     tsebra_default = make_abs('{}/tsebra_default/{}/tsebra_default.gtf'.format(data_dir, mode))
+    files = [braker1, braker2, anno, pseudo, tsebra_default]
+
+    if args.partition:
+        redo_partition(make_abs(args.partition), files)
+        return
 
+    evm = make_abs(args.evm_path)
     if not os.path.exists(workdir):
         os.mkdir(workdir)
 
@@ -54,66 +71,192 @@ def main():
         for line in tab:
             part_lst.append(line)
 
-    pool = mp.Pool(mp.cpu_count())
-    for part in part_lst:
-        pool.apply_async(prep_partition, (part[3], anno, pseudo, braker1, braker2, tsebra_default))
-    pool.close()
-    pool.join()
+    # create hints for EVM and TSEBRA for the whole genome
+    hints = genome_hints(pasa, '{}/topProteins.gff'.format(workdir))
+
+    # add files for TSEBRA runs and evaluation and hints to the partitions
+    for path, name, group in zip(files + hints, file_name + hint_name, \
+        [False] * len(files) + hint_group):
+        key = checkpoint.input_key([path, part_file, '{}/partition.py'.format(bin_dir)], \
+            [group])
+        outputs = ['{}/{}'.format(part[3], name) for part in part_lst]
+        if force or not checkpoint.is_done(workdir, 'split_' + name, key, outputs):
+            split_file(path, part_lst, name, group)
+            checkpoint.mark_done(workdir, 'split_' + name, key)
+
+    # index genome-wide files for the retrieval of single partitions,
+    # indexes that are up to date are kept
+    stale = [path for path in files + [gene_set] if not gff_index.is_current(path)]
+    if stale:
+        with mp.Pool(min(len(stale), mp.cpu_count())) as pool:
+            pool.map(gff_index.build_index, stale)
 
 def braker2evm(braker1, braker2, braker_path):
     # create concatinated set of genes from BRAKER1
     # and BRAKER2 in format that is accepted by EVM
+    key = checkpoint.input_key([braker1, braker2, '{}/braker2evm_format.py'.format(bin_dir)], [evm])
+    if not force and checkpoint.is_done(workdir, 'braker2evm', key, [braker_path]):
+        return
     cmd = 'python3 {}/braker2evm_format.py --braker1 {} --braker2 {} '.format(bin_dir, braker1, braker2) \
         + '--out {} --evm {}'.format(braker_path, evm)
-    call_process(cmd)
+    if call_process(cmd):
+        checkpoint.mark_done(workdir, 'braker2evm', key)
+
+def genome_hints(pasa, protein):
+    # create hints for EVM and TSEBRA from the pasa assemblies
+    # and topProteins of the whole genome
+    hint_dir = '{}/hints'.format(workdir)
+    hints = ['{}/{}'.format(hint_dir, name) for name in hint_name]
+    key = checkpoint.input_key([pasa, protein, '{}/pasa2hints.py'.format(bin_dir), \
+        '{}/topProt2hints.py'.format(bin_dir)])
+    if not force and checkpoint.is_done(workdir, 'hints', key, hints):
+        return hints
+    if not os.path.exists(hint_dir):
+        os.mkdir(hint_dir)
 
-def prep_partition(partition, anno, pseudo, braker1, braker2, tsebra_default):
-    # add files necassary for TSEBRA and evaluation to all partitions
+    cmds = ['python3 {}/pasa2hints.py --pasa {} '.format(bin_dir, pasa) \
+        + '--braker_out {} --evm_out {}'.format(hints[0], hints[1]), \
+        'python3 {}/topProt2hints.py --topProts {} '.format(bin_dir, protein) \
+        + '--braker_out {} --evm_out {}'.format(hints[2], hints[3])]
+    with mp.Pool(len(cmds)) as pool:
+        success = all(pool.map(call_process, cmds))
+    if success:
+        checkpoint.mark_done(workdir, 'hints', key)
+    return hints
 
-    os.chdir(partition)
-    dir = partition.strip('/').split('/')[-1]
-    chr = dir.split('_')[0]
-    start, end = dir.split('_')[1].split('-')
+def redo_partition(partition, files):
+    # recreate the files of one partition from the indexed genome-wide files
+    part_lst = []
+    with open('{}/partitions/part.lst'.format(workdir), 'r') as file:
+        tab = csv.reader(file, delimiter='\t')
+        for line in tab:
+            if os.path.abspath(line[3]) == partition:
+                part_lst.append(line)
+    if not part_lst:
+        raise FileMissing('Partition {} is not listed in part.lst!'.format(partition))
 
-    # create hints for EVM and TSEBRA from pasa assemblies and topProteins
-    cmd = 'python3 {}/pasa2hints.py --braker_out braker_pasa.gff '.format(bin_dir) \
-        + '--pasa sample_mydb_pasa.sqlite.pasa_assemblies.gff3 --evm_out evm_pasa.gff'
-    call_process(cmd)
-    cmd = 'python3 {}/topProt2hints.py --topProts topProteins.gff '.format(bin_dir) \
-        + '--braker_out braker_protein.gff --evm_out evm_protein.gff'
-    call_process(cmd)
+    contig, start, end = partition_range(part_lst[0])
+    for path, name in zip(files, file_name):
+        with open('{}/{}'.format(partition, name), 'w+') as file:
+            for line in gff_index.fetch(path, contig, start, end, adjust=True):
+                file.write(line + '\n')
+    for name, group in zip(hint_name, hint_group):
+        split_file('{}/hints/{}'.format(workdir, name), part_lst, name, group)
 
-    # add files for TSEBRA runs and evaluation to the partitions
-    files = [braker1, braker2, anno, pseudo, tsebra_default]
-    file_name = ['braker1.gtf', 'braker2.gtf', 'annot.gtf', 'pseudo.gff3', 'tsebra_default.gtf']
-    for i in range(0,len(files)):
-        cmd = '{}/EvmUtils/gff_range_retriever.pl {} {} {} ADJUST_TO_ONE < '.format(evm, chr, start, end) \
-            + '{} > {}/{}'.format(files[i], partition, file_name[i])
-        sp.call(cmd, shell=True)
-        cmd = 'sort -k1,1 -k4,4n -k5,5n -o {}/{} {}/{}'.format(partition, \
-            file_name[i], partition, file_name[i])
-        sp.call(cmd, shell=True)
+def partition_range(part):
+    # returns contig, start and end of a line from part.lst, the range
+    # is taken from the partition directory name '<contig>_<start>-<end>'
+    contig = part[0]
+    dir = part[3].rstrip('/').split('/')[-1]
+    if dir.startswith(contig + '_'):
+        start, end = dir[len(contig)+1:].split('-')
+        return contig, int(start), int(end)
+    # contig wasn't partitioned
+    return contig, 1, float('inf')
+
+def read_records(path, group=False):
+    # yields seqid, start, end and lines (as lists of columns) of all features of a
+    # gtf/gff3 file, with group=True consecutive lines with the same seqid and
+    # attributes (e.g. the lines of an alignment in a hint file) are one record
+    record = None
+    with open(path, 'r') as file:
+        for line in file:
+            if line.startswith('#') or not line.strip():
+                continue
+            line = line.rstrip('\n').split('\t')
+            if len(line) < 5:
+                continue
+            start, end = int(line[3]), int(line[4])
+            if group and record and len(line) > 8 and record[0] == line[0] \
+                and record[3][-1][8:] == line[8:]:
+                record[1] = min(record[1], start)
+                record[2] = max(record[2], end)
+                record[3].append(line)
+                continue
+            if record:
+                yield record
+            record = [line[0], start, end, [line]]
+    if record:
+        yield record
+
+def split_file(path, part_lst, file_name, group=False):
+    """Write the features of a file to all partitions in one pass.
+    As with 'gff_range_retriever.pl ... ADJUST_TO_ONE', a feature is added to
+    each partition that contains it and its coordinates are adjusted to the
+    start of the partition. The partition files are sorted like
+    'sort -k1,1 -k4,4n -k5,5n'.
+
+    Args:
+        path (str): gtf/gff3 file with features of the whole genome
+        part_lst (list): lines of part.lst
+        file_name (str): name of the file in the partition directories
+        group (bool): keep consecutive lines with the same attributes together,
+            they are added to a partition if it contains all of them
+    """
+    # partition ranges sorted by start for each contig
+    ranges = {}
+    for part in part_lst:
+        contig, start, end = partition_range(part)
+        if contig not in ranges:
+            ranges[contig] = []
+        ranges[contig].append((start, end, part[3]))
+    starts = {}
+    for contig in ranges:
+        ranges[contig].sort()
+        starts[contig] = [r[0] for r in ranges[contig]]
+    max_len = {c : max([r[1] - r[0] for r in ranges[c]]) for c in ranges}
+
+    out = {part[3] : [] for part in part_lst}
+    for seqid, start, end, lines in read_records(path, group):
+        if seqid not in ranges:
+            continue
+        # all partitions that start before the feature and contain it
+        i = bisect.bisect_right(starts[seqid], start) - 1
+        while i >= 0 and ranges[seqid][i][0] >= start - max_len[seqid]:
+            p_start, p_end, dir = ranges[seqid][i]
+            if end <= p_end:
+                text = []
+                for line in lines:
+                    line = line[:]
+                    line[3] = str(int(line[3]) - p_start + 1)
+                    line[4] = str(int(line[4]) - p_start + 1)
+                    text.append('\t'.join(line))
+                out[dir].append((start, end, '\n'.join(text)))
+            i -= 1
+
+    for dir, lines in out.items():
+        lines.sort()
+        with open('{}/{}'.format(dir, file_name), 'w+') as file:
+            for l in lines:
+                file.write(l[2] + '\n')
 
 def partition(gene_set, transcript, spaln, genome):
     # partition all files that EVM uses
-
-    # get topProteins from Spaln alignment
+    partitions = '{}/partitions/part.lst'.format(workdir)
     protein = '{}/topProteins.gff'.format(workdir)
-    cmd = 'grep topProt=TRUE {} > {}'.format(spaln, protein)
-    sp.call(cmd, shell=True)
+    # the topProteins of the Spaln alignment are imported once into a store
+    # next to spaln.gff, it is only rebuilt if spaln.gff changes
+    store = prot_store.update(spaln)
+    key = checkpoint.input_key([gene_set, transcript, store, genome], \
+        [evm, segmentSize, overlapSize])
+    if not force and checkpoint.is_done(workdir, 'partition', key, [partitions, protein]):
+        return partitions
+
+    # get topProteins sorted by seqid and start from the store
+    prot_store.export(spaln, protein)
 
     # partition all data for EVM
     part_dir = '{}/partitions/'.format(workdir)
     if not os.path.exists(part_dir):
         os.mkdir(part_dir)
     os.chdir(part_dir)
-    partitions = '{}/partitions/part.lst'.format(workdir)
     cmd = '{}/EvmUtils/partition_EVM_inputs.pl --genome {} '.format(evm, genome) \
         + '--gene_predictions {} --transcript_alignments {} '.format(gene_set, transcript) \
         + '--protein_alignments {} --segmentSize {} '.format(protein, segmentSize) \
         + '--overlapSize {} --partition_listing {}'.format(overlapSize, partitions)
     print(cmd)
-    sp.call(cmd, shell=True)
+    if sp.call(cmd, shell=True) == 0:
+        checkpoint.mark_done(workdir, 'partition', key)
 
     return partitions
 
@@ -122,6 +265,8 @@ def call_process(cmd):
     stdout, stderr = q.communicate()
     if stderr.decode():
         sys.stderr.write('Error in {} with: {}'.format(cmd, stderr.decode()))
+        return False
+    return q.returncode == 0
 
 def change_source(file_path, new_source, new_path):
     result = []
@@ -160,6 +305,11 @@ def parseCmd():
         help='Path to the directory where EVidenceModeler is installed')
     parser.add_argument('--out', type=str,
         help='Directory where the partition is created')
+    parser.add_argument('--partition', type=str,
+        help='Only recreate the files of this partition directory from the ' \
+        + 'genome-wide files of a previous run (uses their interval index)')
+    parser.add_argument('--force', action='store_true',
+        help='Redo all steps, even if their inputs didn\'t change')
     return parser.parse_args()
 
 if __name__ == '__main__':
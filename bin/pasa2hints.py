@@ -7,99 +7,59 @@
 import argparse
 import csv
 import sys
+import numpy as np
+from feature_table import FeatureTable
 
-class Transcript:
-    # Handles the alignment of one transcript from the assembly
-
-    def __init__(self, id):
-        self.id = id
-        self.chr = None
-        self.coords = []
-        self.strand = None
-        self.introns = []
-
-    def add_line(self, line):
-        # add a gtf line to tx
-        if not self.chr:
-            self.chr = line[0]
-        if not line[0] == self.chr:
-            sys.stderr.write('Chr. Error at gene_id: \n' + self.id)
-        if not self.strand:
-            self.strand = line[6]
-        if  not line[6] == self.strand:
-            sys.stderr.write('Strand Error at gene_id: \n' + self.id)
-        self.coords.append([int(line[3]), int(line[4])])
-
-    def add_introns(self):
-        # add intron positions to alingment
-        if len(self.coords) > 1:
-            self.coords = sorted(self.coords, key=lambda c:c[0])
-            for i in range(1, len(self.coords)):
-                self.introns.append([self.coords[i-1][1] + 1, self.coords[i][0] - 1])
-
-    def check_coords(self):
-        # remove small alignment gaps
-        self.coords = sorted(self.coords, key=lambda c:c[0])
-        new_coords = [self.coords[0]]
-        for c in self.coords[1:]:
-            if c[0] - new_coords[-1][1] < 3:
-                new_coords[1] = c[1]
-            else:
-                new_coords.append(c)
-        self.coords = new_coords
-
-    def get_gtf(self):
-        # returns gtf for tx alignment
-        out = []
-        for c in self.coords:
-            out.append([self.chr, 'PASA', 'cDNA_match', c[0], c[1], '.', \
-                self.strand, '.', 'ID={};'.format(self.id)])
-        if self.strand == '-':
-            out.reverse()
-        return out
+strand_names = {1 : '+', -1 : '-', 0 : '.'}
 
 def main():
     args = parseCmd()
-    tx = {}
-
-    introns = {}
 
-    # read PASA assembly
-    with open (args.pasa, 'r') as file:
-        for line in file.readlines():
-            line = line.split('\t')
-            if len(line) == 9:
-                id = line[8].split('ID=')[1].split(';')[0]
-                if id not in tx.keys():
-                    tx.update({id : Transcript(id)})
-                tx[id].add_line(line)
+    # read PASA assembly, the alignments are grouped by ID
+    # (tx codes are in the order of the first line of each ID)
+    table = FeatureTable.from_gff(args.pasa, tx_attr='ID')
+    table = table.take(table.tx >= 0)
+    check_alignments(table)
 
     # remove small gaps and add introns to all tx alignments
-    out_evm = []
-    for key in tx.keys():
-        tx[key].check_coords()
-        tx[key].add_introns()
-        out_evm += tx[key].get_gtf()
-        for intron in tx[key].introns:
-            i_key = '{}_{}_{}_{}'.format(tx[key].chr, intron[0], intron[1], tx[key].strand)
-            if not i_key in introns.keys():
-                introns.update({i_key : [tx[key].chr, intron[0], intron[1], tx[key].strand, 0]})
-            introns[i_key][4] += 1
+    table = table.take(np.lexsort((table.start, table.tx)))
+    table = table.merge_gaps(3)
+    introns = table.introns()
 
-    # write hints to files
-    gtf = ''
-    mult = 0
-    for i in introns.values():
-        gtf += '\t'.join([i[0], 'PASA', 'intron', str(i[1]), str(i[2]), '.' , i[3], '.', \
-            'src=E;mult={};pri=4'.format(i[4])])
-        mult += i[4]
-        gtf += '\n'
+    # count introns, in the order of their first occurrence
+    keys = introns.keys(phase=False)
+    unique, first, mult = np.unique(keys, return_index=True, return_counts=True)
+    order = np.argsort(first, kind='stable')
     with open(args.braker_out, 'w+') as file:
-        file.write(gtf)
+        for i in order:
+            file.write('\t'.join([table.seqids[unique['seqid'][i]], 'PASA', 'intron', \
+                str(unique['start'][i]), str(unique['end'][i]), '.', \
+                strand_names[unique['strand'][i]], '.', \
+                'src=E;mult={};pri=4'.format(mult[i])]) + '\n')
+
+    # write alignments in the direction of their strand
+    position = np.where(table.strand == -1, -table.start, table.start)
+    table = table.take(np.lexsort((position, table.tx)))
     with open(args.evm_out, 'w+') as file:
         outGff = csv.writer(file, delimiter='\t')
-        for line in out_evm:
-            outGff.writerow(line)
+        for seqid, start, end, strand, tx in zip(table.seqid.tolist(), \
+            table.start.tolist(), table.end.tolist(), table.strand.tolist(), \
+            table.tx.tolist()):
+            outGff.writerow([table.seqids[seqid], 'PASA', 'cDNA_match', start, end, '.', \
+                strand_names[strand], '.', 'ID={};'.format(table.tx_ids[tx])])
+
+def check_alignments(table):
+    # all lines of an alignment get the seqid and strand of its first line,
+    # lines with a different seqid or strand are reported
+    tx, first = np.unique(table.tx, return_index=True)
+    first_line = np.zeros(len(table.tx_ids), dtype=np.int64)
+    first_line[tx] = first
+    for col, error in [('seqid', 'Chr.'), ('strand', 'Strand')]:
+        values = getattr(table, col)[first_line[table.tx]]
+        for i in np.flatnonzero(values != getattr(table, col)):
+            sys.stderr.write('{} Error at gene_id: \n{}'.format(error, \
+                table.tx_ids[table.tx[i]]))
+        setattr(table, col, values)
 
 def parseCmd():
     """Parse command line arguments
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# prot_store.py: Import the topProt=TRUE alignments of a Spaln file
+# once into a store and retrieve the alignments of a region from it
+# ==============================================================
+import argparse
+import array
+import bisect
+import json
+import os
+import sys
+import tempfile
+from topProt2hints import get_new_id
+from gff_index import parse_region
+
+# store file layout: one json header line with the size and mtime of the
+# Spaln file and for each seqid the number of alignments, their maximal
+# length and the position of its block, followed by the blocks and the data.
+# A block holds the arrays start, end, data offset and data length (int64) of
+# all alignments of a seqid, sorted by start and end. The data are the gff
+# lines of the alignments in the order of the blocks, the lines of an
+# alignment are in the order of the Spaln file.
+
+class RegionError(Exception):
+    pass
+
+class NotGrouped(Exception):
+    pass
+
+store_filter = b'topProt=TRUE'
+
+def store_path(path):
+    return path + '.topProt'
+
+def read_alignments(path, grouped=True):
+    # yields seqid, start, end and text of all alignments with topProt=TRUE,
+    # lines with the same seqid, prot and seed_gene_id are one alignment.
+    # If grouped is set, an alignment has to be consecutive in the file
+    current = {}
+    done = set()
+    with open(path, 'rb') as file:
+        for line in file:
+            if store_filter not in line or line.startswith(b'#'):
+                continue
+            columns = line.rstrip(b'\n').split(b'\t')
+            if len(columns) != 9:
+                continue
+            key = (columns[0].decode(), get_new_id(columns[8].decode()))
+            if grouped and key not in current:
+                if key in done:
+                    raise NotGrouped()
+                for prev_key, item in current.items():
+                    yield item
+                    done.add(prev_key)
+                current = {}
+            start, end = int(columns[3]), int(columns[4])
+            if line[-1:] != b'\n':
+                line += b'\n'
+            if key not in current:
+                current[key] = [key[0], start, end, line]
+            else:
+                item = current[key]
+                item[1] = min(item[1], start)
+                item[2] = max(item[2], end)
+                item[3] += line
+    for item in current.values():
+        yield item
+
+def build_store(path):
+    """Import the alignments with topProt=TRUE of a Spaln file into the
+    store '<path>.topProt'
+
+    Args:
+        path (str): path to the gff file of Spaln
+    """
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as data:
+        try:
+            alignments = write_data(path, data)
+        except NotGrouped:
+            data.seek(0)
+            data.truncate()
+            alignments = write_data(path, data, grouped=False)
+
+        header = {'size' : os.path.getsize(path), 'mtime' : os.path.getmtime(path), \
+            'seqids' : {}}
+        blocks = []
+        position = 0
+        data_offset = 0
+        for seqid in sorted(alignments.keys()):
+            coords = sorted(alignments[seqid])
+            offsets = []
+            for c in coords:
+                offsets.append(data_offset)
+                data_offset += c[3]
+            block = array.array('q', [c[0] for c in coords] + [c[1] for c in coords] \
+                + offsets + [c[3] for c in coords])
+            header['seqids'][seqid] = {'count' : len(coords), 'position' : position, \
+                'max_len' : max([c[1] - c[0] for c in coords])}
+            position += len(block) * block.itemsize
+            blocks.append((block, coords))
+        header['data'] = position
+
+        # copy the data of the alignments in the order of the blocks
+        with temp_file(store_path(path)) as file:
+            try:
+                file.write(json.dumps(header).encode() + b'\n')
+                for block, coords in blocks:
+                    block.tofile(file)
+                for block, coords in blocks:
+                    for c in coords:
+                        data.seek(c[2])
+                        file.write(data.read(c[3]))
+            except BaseException:
+                os.remove(file.name)
+                raise
+    os.replace(file.name, store_path(path))
+
+def temp_file(path):
+    # unique temporary file next to path, processes that write
+    # the same file at the same time don't collide
+    return tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)), \
+        prefix=os.path.basename(path) + '.', delete=False)
+
+def write_data(path, data, grouped=True):
+    # write the text of all alignments to data, returns
+    # seqid -> [(start, end, offset, length)]
+    alignments = {}
+    for seqid, start, end, text in read_alignments(path, grouped):
+        if seqid not in alignments:
+            alignments[seqid] = []
+        alignments[seqid].append((start, end, data.tell(), len(text)))
+        data.write(text)
+    return alignments
+
+def read_header(path):
+    # returns the header of a store and its length in bytes
+    with open(store_path(path), 'rb') as file:
+        line = file.readline()
+    return json.loads(line), len(line)
+
+def is_current(path):
+    # check if the store of a Spaln file exists and is up to date
+    if not os.path.exists(store_path(path)):
+        return False
+    header, length = read_header(path)
+    return header['size'] == os.path.getsize(path) \
+        and header['mtime'] == os.path.getmtime(path)
+
+def update(path):
+    """Create the store of a Spaln file if it is missing or older than the file
+
+    Args:
+        path (str): path to the gff file of Spaln
+
+    Returns:
+        str: path of the store
+    """
+    if not is_current(path):
+        build_store(path)
+    return store_path(path)
+
+def fetch(path, seqid, start, end, adjust=False, overlap=False):
+    """Retrieve all alignments of a region, the store is created if it is
+    missing or older than the Spaln file
+
+    Args:
+        path (str): path to the gff file of Spaln
+        seqid (str): sequence of the region
+        start (int): start of the region
+        end (int): end of the region
+        adjust (bool): adjust coordinates to the start of the region
+        overlap (bool): return all alignments that overlap the region
+            instead of only those that are contained in it
+
+    Returns:
+        list: lines (without newline) of the alignments sorted by the start
+            and end of the alignments
+    """
+    update(path)
+    header, length = read_header(path)
+    if seqid not in header['seqids']:
+        return []
+    info = header['seqids'][seqid]
+    count = info['count']
+    block = array.array('q')
+    with open(store_path(path), 'rb') as file:
+        file.seek(length + info['position'])
+        block.fromfile(file, 4 * count)
+    starts = block[:count]
+
+    # alignments that start in [start - max_len, end]
+    first = bisect.bisect_left(starts, start - info['max_len'])
+    last = bisect.bisect_right(starts, end)
+    result = []
+    with open(store_path(path), 'rb') as file:
+        for i in range(first, last):
+            if overlap:
+                if block[count + i] < start:
+                    continue
+            elif starts[i] < start or block[count + i] > end:
+                continue
+            file.seek(length + header['data'] + block[2 * count + i])
+            for line in file.read(block[3 * count + i]).decode().splitlines():
+                if adjust:
+                    line = line.split('\t')
+                    line[3] = str(int(line[3]) - start + 1)
+                    line[4] = str(int(line[4]) - start + 1)
+                    line = '\t'.join(line)
+                result.append(line)
+    return result
+
+def export(path, out):
+    """Write all alignments of the store sorted by seqid and start to a gff file,
+    the store is created if it is missing or older than the Spaln file
+
+    Args:
+        path (str): path to the gff file of Spaln
+        out (str): output file
+    """
+    update(path)
+    header, length = read_header(path)
+    with open(store_path(path), 'rb') as file_in, temp_file(out) as file_out:
+        try:
+            file_in.seek(length + header['data'])
+            for chunk in iter(lambda: file_in.read(1 << 20), b''):
+                file_out.write(chunk)
+        except BaseException:
+            os.remove(file_out.name)
+            raise
+    os.replace(file_out.name, out)
+
+def main():
+    args = parseCmd()
+    if args.build:
+        build_store(args.spaln)
+        return
+    if args.out:
+        export(args.spaln, args.out)
+        return
+    if not args.region:
+        raise RegionError('Provide a region with --region, --out or use --build.')
+    seqid, start, end = parse_region(args.region)
+    for line in fetch(args.spaln, seqid, start, end, args.adjust, args.overlap):
+        sys.stdout.write(line + '\n')
+
+def parseCmd():
+    """Parse command line arguments
+
+    Returns:
+        dictionary: Dictionary with arguments
+    """
+    parser = argparse.ArgumentParser(description='Import the topProt=TRUE alignments ' \
+        + 'of a Spaln file into a store and retrieve the alignments of a region.')
+    parser.add_argument('--spaln', type=str,
+        help='Protein alignments of Spaln in gff format')
+    parser.add_argument('--build', action='store_true',
+        help='Only create (or update) the store of the file')
+    parser.add_argument('--out', type=str,
+        help='Write all alignments of the store to this file')
+    parser.add_argument('--region', type=str,
+        help='Region in the format seqid:start-end')
+    parser.add_argument('--adjust', action='store_true',
+        help='Adjust coordinates to the start of the region')
+    parser.add_argument('--overlap', action='store_true',
+        help='Retrieve all alignments overlapping the region instead of ' \
+        + 'only the alignments contained in it')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    main()
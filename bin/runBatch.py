@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# runBatch.py: Run the evaluation of experiment 1 and all steps of
+# experiment 2 for several species and test levels with one process pool
+# and create the summary tables of all results
+# ==============================================================
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import dag
+import runExp2
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+test_level = ['species_excluded', 'family_excluded', 'order_excluded']
+# test level of the species that aren't in model_species.tab
+default_level = 'order_excluded'
+# estimated peak memory of eval_exp1.py, relative to the size of the annotation,
+# and its priority among the task types of runExp2.rank
+exp1_memory_factor = 20
+exp1_rank = 0
+
+def main():
+    args = parseCmd()
+    runExp2.set_options(args.evm_path, args.force, args.timeout, args.retries, \
+        args.in_process)
+    parent_dir = os.path.abspath(args.parent_dir)
+    levels = args.test_level or test_level
+
+    # experiment 1 for all species, experiment 2 only for the model species,
+    # the model species are evaluated for all levels, the others only for order_excluded
+    species_list = read_species(args.species)
+    model_species = read_species(args.model_species)
+    graph = dag.Graph()
+    experiments = []
+    for species in species_list + [s for s in model_species if s not in species_list]:
+        species_dir = '{}/{}'.format(parent_dir, species)
+        for level in levels:
+            if species not in model_species and level != default_level:
+                continue
+            if not args.no_exp1:
+                add_exp1(graph, species_dir, level)
+            if species in model_species and not args.no_exp2:
+                exp = runExp2.Experiment(species_dir, level)
+                missing = exp.missing_inputs()
+                if missing:
+                    sys.stderr.write('### Skipping experiment 2 for {} {}, missing: {}\n'.format(\
+                        species, level, ', '.join(missing)))
+                    continue
+                exp.add_tasks(graph)
+                experiments.append(exp)
+    sys.stderr.write('### Experiment 2: {} species and test levels\n'.format(len(experiments)))
+
+    # memory limit: --memory or the physical memory of the node
+    memory = args.memory * 1024 if args.memory else \
+        os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2**20
+    with mp.Pool(args.threads) as pool:
+        graph.run(pool, args.threads, lambda n, s, r: runExp2.on_done(graph, n, s, r), memory)
+
+    complete = [exp.write_results(graph.status) for exp in experiments]
+    failed = [n for n in graph.tasks if n.startswith('exp1:') and graph.status[n] != 'ok']
+    for name in failed:
+        sys.stderr.write('### Evaluation of experiment 1 failed: {}\n'.format(name))
+    sys.stderr.write('### Experiment 2 finished for {} of {} species and test levels\n'.format(\
+        sum(complete), len(complete)))
+    runExp2.summary(parent_dir, args.plot)
+
+def add_exp1(graph, species_dir, level):
+    # evaluate BRAKER1, BRAKER2 and TSEBRA of experiment 1 for the whole genome
+    tsebra_default = '{}/tsebra_default/{}/tsebra_default.gtf'.format(species_dir, level)
+    if not os.path.exists(tsebra_default):
+        sys.stderr.write('### Skipping experiment 1 for {} {}, missing: {}\n'.format(\
+            os.path.basename(species_dir), level, tsebra_default))
+        return
+    cmd = 'python3 {}/bin/eval_exp1.py --species_dir {} --test_level {}'.format(\
+        repo_dir, species_dir, level)
+    runExp2.add_task(graph, None, 'exp1:{}:{}'.format(species_dir, level), runExp2.run_step, \
+        (cmd,), [], runExp2.file_size(['{}/annot/annot.gtf'.format(species_dir)]), \
+        exp1_memory_factor, exp1_rank)
+
+def read_species(path):
+    # read a species table, one species per line
+    species = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line and not line[0] == '#':
+                species.append(line)
+    return species
+
+def parseCmd():
+    """Parse command line arguments
+
+    Returns:
+        dictionary: Dictionary with arguments
+    """
+    parser = argparse.ArgumentParser(description='Run the evaluation of experiment 1 ' \
+        + 'and all steps of experiment 2 for several species and test levels ' \
+        + 'with one process pool.')
+    parser.add_argument('--parent_dir', type=str,
+        help='Directory containing the directories of all species')
+    parser.add_argument('--evm_path', type=str,
+        help='Path to the directory where EVidenceModeler is installed')
+    parser.add_argument('--species', type=str,
+        default='{}/species.tab'.format(repo_dir),
+        help='Species of experiment 1 (default: species.tab)')
+    parser.add_argument('--model_species', type=str,
+        default='{}/model_species.tab'.format(repo_dir),
+        help='Species of experiment 1 and 2 (default: model_species.tab)')
+    parser.add_argument('--test_level', type=str, nargs='+',
+        help='Test levels (default: all, the species that aren\'t in ' \
+        + 'model_species.tab are only evaluated for order_excluded)')
+    parser.add_argument('--threads', type=int, default=1,
+        help='Number of tasks that run at the same time')
+    parser.add_argument('--memory', type=float,
+        help='Start tasks only while their estimated memory fits into this ' \
+        + 'limit (GB, default: physical memory)')
+    parser.add_argument('--no_exp1', action='store_true',
+        help='Don\'t evaluate experiment 1')
+    parser.add_argument('--no_exp2', action='store_true',
+        help='Don\'t run experiment 2')
+    parser.add_argument('--in_process', action='store_true',
+        help='Import TSEBRA once per worker instead of running tsebra.py for each partition')
+    parser.add_argument('--timeout', type=float,
+        help='Stop an EVM or TSEBRA run after this many seconds')
+    parser.add_argument('--retries', type=int, default=0,
+        help='Number of retries for an EVM or TSEBRA run that failed or timed out')
+    parser.add_argument('--plot', action='store_true',
+        help='Also run plot_exp2.py')
+    parser.add_argument('--force', action='store_true',
+        help='Redo all steps, even if their inputs didn\'t change')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,15 @@
 # runEVM.py: Run EVM for a set of partitions
 # ==============================================================
 import argparse
-import subprocess as sp
-import multiprocessing as mp
 import os
 import csv
 import sys
+import time
+import checkpoint
+import job_runner
+import executor
+import evm2gtf
+from partition import partition_range
 
 class FileMissing(Exception):
     pass
@@ -20,13 +24,29 @@ workdir = ''
 partition_list = []
 weights = ''
 threads = 1
+force = False
+# convert evm.out with EVM_to_GFF3.pl instead of evm2gtf.convert
+evm_script = False
+# timeout (s) and number of retries of an EVM run
+timeout = None
+retries = 0
+# EVM inputs of each partition
+evm_inputs = ['genome.fasta.masked', 'gene_set.gff', 'evm_pasa.gff', 'evm_protein.gff']
+# evidence files whose features are counted for the cost of a partition
+cost_inputs = ['gene_set.gff', 'evm_pasa.gff', 'evm_protein.gff']
+
 def main():
-    global evm, workdir, partition_list, weights, bin, threads
+    global evm, workdir, partition_list, weights, bin, threads, force, timeout, retries, \
+        evm_script
     args = parseCmd()
 
     workdir = os.path.abspath('{}/EVM/{}/'.format(args.species_dir, args.test_level))
     evm = os.path.abspath(args.evm_path)
     threads = args.threads
+    force = args.force
+    timeout = args.timeout
+    retries = args.retries
+    evm_script = args.evm_script
 
     # read partition lists
     partition_list_path = '{}/partitions/part_test.lst'.format(workdir)
@@ -44,42 +64,123 @@ def main():
     for part in partition_list:
         prediction(part[3], part[0])
     '''
-    # Run evm predicitons
-    job_results = []
-    pool = mp.Pool(threads)
-    for part in partition_list:
-        r = pool.apply_async(prediction, (part[3], part[0]))
-        job_results.append(r)
-    for r in job_results:
-        r.wait()
-    pool.close()
-    pool.join()
-def prediction(exec_dir, contig):
-    # make a EVM predcition for one partition
-    part_name = exec_dir.split('/')[-1]
-    start = int(part_name.split('_')[1].split('-')[0])
-    chr = part_name.split('_')[0]
+    # Run evm predicitons, most expensive partitions first so that
+    # no long EVM run is left for the end
+    jobs = sorted([(partition_cost(p), p[3], p[0]) for p in partition_list], reverse=True)
+    total_cost = sum([j[0] for j in jobs])
+    done_cost = 0
+    start_time = time.time()
+    reports = {}
+    with executor.create(args.executor, threads, init_worker, \
+        ((evm, weights, force, timeout, retries, evm_script),)) as ex:
+        for i, (cost, report) in enumerate(ex.map_unordered(prediction_job, jobs)):
+            reports[report['partition']] = report
+            done_cost += cost
+            elapsed = time.time() - start_time
+            eta = elapsed * (total_cost - done_cost) / done_cost if done_cost else 0
+            sys.stderr.write('### EVM: {}/{} partitions, {:.1f}% of estimated cost, '.format(\
+                i + 1, len(jobs), 100 * done_cost / total_cost if total_cost else 100) \
+                + 'elapsed {}, ETA {}\n'.format(format_time(elapsed), format_time(eta)))
 
-    # Run EVM
+    # write status of all partitions, partitions that failed are rerun
+    # in the next run of runEVM.py as they have no completion marker
+    manifest = '{}/evm_manifest.json'.format(workdir)
+    failed = job_runner.write_manifest([reports[p[3]] for p in partition_list], manifest)
+    if failed:
+        sys.stderr.write('### EVM failed for {} partitions:\n'.format(len(failed)))
+        for r in failed:
+            sys.stderr.write('{}\t{}\texit code {}\n'.format(r['partition'], \
+                r['status'], r['exit_code']))
+    sys.stderr.write('### Status of all partitions is located at {}\n'.format(manifest))
+
+def partition_cost(part):
+    # estimated runtime of EVM for a partition: number of features
+    # of all evidence files plus the length of the partition in kb
+    features = 0
+    for file_name in cost_inputs:
+        path = '{}/{}'.format(part[3], file_name)
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1 << 20), b''):
+                    features += chunk.count(b'\n')
+    contig, start, end = partition_range(part)
+    if end == float('inf'):
+        # contig wasn't partitioned, use the size of its sequence
+        genome = '{}/genome.fasta.masked'.format(part[3])
+        length = os.path.getsize(genome) if os.path.exists(genome) else 0
+    else:
+        length = end - start + 1
+    return features + length / 1000
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def init_worker(options):
+    # set the options of main in a worker of the executor
+    global evm, weights, force, timeout, retries, evm_script
+    evm, weights, force, timeout, retries, evm_script = options
+
+def prediction_job(job):
+    cost, exec_dir, contig = job
+    return cost, prediction(exec_dir, contig)
+
+def prediction(exec_dir, contig, weights_path=''):
+    # make a EVM predcition for one partition, returns the report of the run,
+    # weights_path replaces the weight file of the workdir (optional)
+    weights_path = weights_path or weights
+
+    # skip partitions that have an EVM prediction for the same inputs
     evm_out = '{}/evm.out'.format(exec_dir)
+    gtf_out = '{}/evm.gtf'.format(exec_dir)
+    key = checkpoint.input_key(['{}/{}'.format(exec_dir, f) for f in evm_inputs] \
+        + [weights_path, '{}/evidence_modeler.pl'.format(evm), '{}/evm2gtf.py'.format(bin)], \
+        ['evm_script' if evm_script else 'native'])
+    if not force and checkpoint.is_done(exec_dir, 'evm', key, \
+        prediction_outputs(evm_out, gtf_out)):
+        return {'partition' : exec_dir, 'status' : 'skipped'}
+
+    # remove the prediction of an earlier run, so that a failed run
+    # doesn't leave an old evm.gtf for the evaluation
+    checkpoint.clear(exec_dir, 'evm')
+    if os.path.exists(gtf_out):
+        os.remove(gtf_out)
+
+    # Run EVM
     evm_cmd = '{}/evidence_modeler.pl -G genome.fasta.masked -g gene_set.gff'.format(evm) \
         + ' -w {} -e evm_pasa.gff -p evm_protein.gff --exec_dir {} > {} 2> {}.log'.format(\
-        weights, exec_dir, evm_out, evm_out)
+        weights_path, exec_dir, evm_out, evm_out)
+
+    try:
+        report, stderr = job_runner.run_cmd(evm_cmd, timeout, retries)
+        report['partition'] = exec_dir
+        if stderr:
+            sys.stderr.write('Error in {} with: {}'.format(evm_cmd, stderr))
+        if report['status'] != 'ok':
+            return report
 
-    q = sp.Popen(evm_cmd, shell=True, stdout=sp.PIPE, stderr=sp.PIPE)
-    stdout, stderr = q.communicate()
-    if stderr.decode():
-        sys.stderr.write('Error in {} with: {}'.format(evm_cmd, stderr.decode()))
+        # check if EVM predicted at least one gene and convert evm.out to gtf format
+        if not os.stat(evm_out).st_size == 0:
+            if evm_script:
+                evm2gtf.convert_script(evm_out, contig, gtf_out, evm)
+            else:
+                evm2gtf.convert(evm_out, contig, gtf_out)
+    except Exception as e:
+        sys.stderr.write('Error in EVM prediction of {} with: {}\n'.format(exec_dir, e))
+        if os.path.exists(gtf_out):
+            os.remove(gtf_out)
+        return {'partition' : exec_dir, 'status' : 'failed', 'exit_code' : None, \
+            'error' : str(e)}
 
-    # check if EVM predicted at least one gene and convert evm.out to gff and gtf format
-    if not os.stat(evm_out).st_size == 0:
-        gff_out = '{}/evm.gff'.format(exec_dir, part_name)
-        cmd = '{}/EvmUtils/EVM_to_GFF3.pl {} {} > {}'.format(evm, evm_out, contig, gff_out)
-        sp.call(cmd, shell=True)
+    checkpoint.mark_done(exec_dir, 'evm', key)
+    return report
 
-        gtf_out = '{}/evm.gtf'.format(exec_dir, part_name)
-        cmd = '{}/gff32gtf.py --gff {} --out {}'.format(bin, gff_out, gtf_out)
-        sp.call(cmd, shell=True)
+def prediction_outputs(evm_out, gtf_out):
+    # outputs of a completed EVM run, evm.gtf is only written
+    # if EVM predicted at least one gene
+    if os.path.exists(evm_out) and os.path.getsize(evm_out) > 0:
+        return [evm_out, gtf_out]
+    return [evm_out]
 
 def parseCmd():
     """Parse command line arguments
@@ -96,6 +197,18 @@ def parseCmd():
         help='Path to the directory where EVidenceModeler is installed')
     parser.add_argument('--threads', type=int,
         help='')
+    parser.add_argument('--force', action='store_true',
+        help='Rerun EVM for all partitions, even if their inputs didn\'t change')
+    parser.add_argument('--timeout', type=float,
+        help='Stop an EVM run after this many seconds')
+    parser.add_argument('--retries', type=int, default=0,
+        help='Number of retries for an EVM run that failed or timed out')
+    parser.add_argument('--evm_script', action='store_true',
+        help='Convert the EVM output with EVM_to_GFF3.pl and gff32gtf.py instead ' \
+        + 'of the native conversion of evm2gtf.py')
+    parser.add_argument('--executor', type=str, default='pool',
+        help='"pool" (default) or "socket:<host>:<port>" to distribute the partitions ' \
+        + 'to worker daemons started with executor.py --address <host>:<port>')
     return parser.parse_args()
 
 if __name__ == '__main__':
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# runExp2.py: Run all steps of TSEBRA-experiment 2 for one species and
+# test level, the steps of all partitions share one process pool
+# ==============================================================
+import argparse
+import multiprocessing as mp
+import os
+import csv
+import sys
+import dag
+import job_runner
+import runEVM
+import runTSEBRA
+import eval_exp2
+import tsebra_combine
+from compare_intervals import Score
+
+class FileMissing(Exception):
+    pass
+
+class StepFailed(Exception):
+    pass
+
+bin = os.path.dirname(os.path.realpath(__file__))
+# estimated peak memory (MB) of a task: memory_base + memory_factor * size of
+# its inputs (MB), the factor of EVM is raised if a run needed more
+memory_base = 200
+memory_factor = {'partition' : 4, 'sample' : 0, 'evm' : 20, 'tsebra' : 10, 'eval' : 5}
+# priority of the task types, tasks of the same type start largest first
+rank = {'partition' : 3, 'sample' : 3, 'eval' : 2, 'evm' : 1, 'tsebra' : 0}
+# task name -> size of its inputs (MB) and the experiment it belongs to (if any)
+task_size = {}
+owner = {}
+
+def main():
+    args = parseCmd()
+    set_options(args.evm_path, args.force, args.timeout, args.retries, args.in_process)
+
+    exp = Experiment(args.species_dir, args.test_level, args.seed)
+    for path in exp.missing_inputs():
+        raise FileMissing('{} is missing.'.format(path))
+    graph = dag.Graph()
+    exp.add_tasks(graph)
+
+    memory = args.memory * 1024 if args.memory else None
+    with mp.Pool(args.threads) as pool:
+        graph.run(pool, args.threads, lambda n, s, r: on_done(graph, n, s, r), memory)
+
+    if exp.write_results(graph.status) and args.parent_dir:
+        summary(args.parent_dir, args.plot)
+
+def set_options(evm_path, force, timeout, retries, in_process):
+    # settings of the steps, the workers of the pool inherit them
+    runEVM.evm = os.path.abspath(evm_path)
+    for module in [runEVM, runTSEBRA, eval_exp2]:
+        module.force = force
+    for module in [runEVM, runTSEBRA]:
+        module.timeout = timeout
+        module.retries = retries
+    if in_process:
+        try:
+            tsebra_combine.load_tsebra()
+            runTSEBRA.in_process = True
+        except tsebra_combine.TsebraMissing as e:
+            sys.stderr.write('{}\nRunning tsebra.py as subprocess.\n'.format(e))
+
+def file_size(paths):
+    # size of all existing files in MB
+    return sum([os.path.getsize(p) for p in paths if os.path.exists(p)]) / 2**20
+
+def memory_estimate(step, size, factor=None):
+    if factor is None:
+        factor = memory_factor[step]
+    return memory_base + factor * size
+
+def add_task(graph, exp, name, func, args, deps, size, factor=None, priority=None):
+    # add a task of an experiment, its priority and memory are estimated
+    # from its type and the size of its inputs, factor and priority
+    # are needed for task types that aren't in memory_factor and rank
+    step = name.split(':')[0]
+    if priority is None:
+        priority = rank[step]
+    task_size[name] = size
+    owner[name] = exp
+    graph.add(dag.Task(name, func, args, deps, (priority, size), \
+        memory_estimate(step, size, factor)))
+
+def on_done(graph, name, status, result):
+    # pass the result of a task to its experiment and report the progress
+    if owner.get(name):
+        owner[name].on_done(graph, name, status, result)
+    sys.stderr.write('### {}/{} tasks finished ({})\n'.format(\
+        len([s for s in graph.status.values() if s in ['ok', 'failed', 'cancelled']]), \
+        len(graph.status), name))
+
+def update_memory(graph, name, report):
+    # raise the memory factor of EVM if a run needed more than estimated
+    # and update the estimates of all EVM tasks that didn't start yet
+    if not task_size.get(name) or not report.get('peak_rss'):
+        return
+    factor = (report['peak_rss'] / 1024 - memory_base) / task_size[name]
+    if factor <= memory_factor['evm']:
+        return
+    memory_factor['evm'] = factor
+    for n, task in graph.tasks.items():
+        if n.startswith('evm:') and graph.status[n] in ['waiting', 'ready']:
+            task.memory = memory_estimate('evm', task_size[n])
+
+class Experiment:
+    """Tasks and results of experiment 2 for one species and test level
+
+    Args:
+        species_dir (str): directory of the species
+        test_level (str): one of "species_excluded", "family_excluded" or "order_excluded"
+        seed (str): file with the seed value for sample_partitions.py (optional)
+    """
+    def __init__(self, species_dir, test_level, seed=None):
+        self.species_dir = os.path.abspath(species_dir)
+        self.test_level = test_level
+        self.seed = seed
+        self.workdir = '{}/EVM/{}'.format(self.species_dir, test_level)
+        self.weights = '{}/EVM.weights.tab'.format(self.workdir)
+        self.cfg = '{}/tsebra.cfg'.format(self.workdir)
+        self.prep = []
+        self.tasks = []
+        self.partition_list = []
+        self.reports = {'evm' : {}, 'tsebra' : {}}
+        self.warnings = []
+        self.total = {meth : {m : Score(0,0,0) for m in eval_exp2.modes} \
+            for meth in eval_exp2.methods}
+
+    def missing_inputs(self):
+        return [p for p in [self.weights, self.cfg] if not os.path.exists(p)]
+
+    def add(self, graph, name, func, args, deps, size):
+        add_task(graph, self, name, func, args, deps, size)
+        self.tasks.append(name)
+
+    def add_tasks(self, graph):
+        # partition the genome and sample the test partitions (if there is no
+        # part_test.lst yet), the tasks of the partitions are added after that
+        part_dir = '{}/partitions'.format(self.workdir)
+        name = 'partition:{}'.format(self.workdir)
+        cmd = 'python3 {}/partition.py --species_dir {} '.format(bin, self.species_dir) \
+            + '--test_level {} --evm_path {} --out {}'.format(self.test_level, \
+            runEVM.evm, self.workdir) + (' --force' if runEVM.force else '')
+        size = file_size(['{}/data/genome.fasta.masked'.format(self.species_dir), \
+            '{}/braker2/{}/Spaln/spaln.gff'.format(self.species_dir, self.test_level)])
+        self.add(graph, name, run_step, (cmd,), [], size)
+        self.prep = [name]
+        if not os.path.exists('{}/part_test.lst'.format(part_dir)):
+            cmd = 'python3 {}/sample_partitions.py --partition_dir {}'.format(bin, part_dir)
+            if self.seed:
+                cmd += ' --seed {}'.format(os.path.abspath(self.seed))
+            self.add(graph, 'sample:{}'.format(self.workdir), run_step, (cmd,), [name], 0)
+            self.prep.append('sample:{}'.format(self.workdir))
+
+    def on_done(self, graph, name, status, result):
+        # add the tasks of all partitions after the partitioning, collect the
+        # reports of EVM and TSEBRA and the scores of the evaluations
+        step = name.split(':')[0]
+        if name in self.prep:
+            if all([graph.status[n] == 'ok' for n in self.prep]):
+                self.add_partition_tasks(graph)
+        elif step in self.reports:
+            if status == 'ok':
+                report = result[0] if step == 'tsebra' else result
+            elif isinstance(result, StepFailed):
+                report = result.args[0]
+            else:
+                report = {'partition' : graph.tasks[name].args[0], 'status' : 'failed', \
+                    'exit_code' : None}
+            self.reports[step][report['partition']] = report
+            if step == 'evm' and status == 'ok':
+                update_memory(graph, name, report)
+            if step == 'tsebra' and status == 'ok':
+                for w in result[1]:
+                    self.warnings.append([report['partition'], w])
+        elif step == 'eval' and status == 'ok':
+            method, score = result
+            for m in eval_exp2.modes:
+                self.total[method][m] = eval_exp2.sum_score_lst([self.total[method][m], \
+                    score[m]])
+
+    def add_partition_tasks(self, graph):
+        # tasks of each test partition: EVM, TSEBRA and the evaluation of all methods,
+        # evaluations start as soon as their prediction exists, EVM runs start
+        # largest first and TSEBRA runs fill the slots at the end of the EVM runs
+        with open('{}/partitions/part_test.lst'.format(self.workdir), 'r') as file:
+            part = csv.reader(file, delimiter='\t')
+            for p in part:
+                self.partition_list.append(p)
+        for p in self.partition_list:
+            exec_dir = p[3]
+            self.add(graph, 'evm:{}'.format(exec_dir), evm_task, \
+                (exec_dir, p[0], self.weights), self.prep, \
+                file_size(['{}/{}'.format(exec_dir, f) for f in runEVM.evm_inputs]))
+            self.add(graph, 'tsebra:{}'.format(exec_dir), tsebra_task, \
+                (exec_dir, self.cfg), self.prep, \
+                file_size(['{}/{}'.format(exec_dir, f) for f in runTSEBRA.tsebra_inputs]))
+            size = 2 * file_size(['{}/annot.gtf'.format(exec_dir)])
+            for method, gene_pred in zip(eval_exp2.methods, eval_exp2.methods_files):
+                deps = list(self.prep)
+                if method == 'EVM':
+                    deps.append('evm:{}'.format(exec_dir))
+                elif method == 'TSEBRA_EVM':
+                    deps.append('tsebra:{}'.format(exec_dir))
+                self.add(graph, 'eval:{}:{}'.format(method, exec_dir), eval_task, \
+                    (exec_dir, method, gene_pred), deps, size)
+
+    def write_results(self, status):
+        """Write the status of all EVM and TSEBRA runs and the evaluation,
+        the evaluation is only written if all tasks of the experiment finished
+
+        Args:
+            status (dictionary): status of all tasks of the graph
+
+        Returns:
+            bool: True if the evaluation was written
+        """
+        for step, name in [('evm', 'EVM'), ('tsebra', 'TSEBRA')]:
+            manifest = '{}/{}_manifest.json'.format(self.workdir, step)
+            reports = [self.reports[step][p[3]] for p in self.partition_list \
+                if p[3] in self.reports[step]]
+            failed = job_runner.write_manifest(reports, manifest)
+            if failed:
+                sys.stderr.write('### {} failed for {} partitions:\n'.format(name, len(failed)))
+                for r in failed:
+                    sys.stderr.write('{}\t{}\texit code {}\n'.format(r['partition'], \
+                        r['status'], r['exit_code']))
+        warnings_path = '{}/tsebra_warnings.tab'.format(self.workdir)
+        if os.path.exists(warnings_path):
+            os.remove(warnings_path)
+        if self.warnings:
+            with open(warnings_path, 'w+') as file:
+                csv.writer(file, delimiter='\t').writerows(self.warnings)
+            sys.stderr.write('{} TSEBRA warnings, see {}\n'.format(len(self.warnings), \
+                warnings_path))
+
+        unfinished = [name for name in self.tasks if status[name] != 'ok']
+        if unfinished:
+            sys.stderr.write('### {} tasks of {} failed or were cancelled, '.format(\
+                len(unfinished), self.workdir) + 'rerun to repeat only them:\n')
+            for name in unfinished:
+                sys.stderr.write('{}\t{}\n'.format(name, status[name]))
+            return False
+        eval_exp2.workdir = self.workdir
+        if not os.path.exists('{}/evaluation/'.format(self.workdir)):
+            os.makedirs('{}/evaluation/'.format(self.workdir))
+        eval = eval_exp2.measure_scores(self.total)
+        eval_exp2.full_eval(eval)
+        for mea in eval_exp2.measures:
+            eval_exp2.single_eval(eval, mea)
+        sys.stderr.write('### Evaluation is located at {}/evaluation/\n'.format(self.workdir))
+        return True
+
+def summary(parent_dir, plot=False):
+    # collect the results of all species with eval_summary.py (and plot_exp2.py)
+    cmds = ['python3 {}/eval_summary.py --parent_dir {}'.format(bin, parent_dir)]
+    if plot:
+        cmds.append('python3 {}/plot_exp2.py --parent_dir {}'.format(bin, parent_dir))
+    for cmd in cmds:
+        report, stderr = job_runner.run_cmd(cmd)
+        sys.stderr.write(stderr)
+
+def run_step(cmd):
+    # run a script of a genome-wide step
+    report, stderr = job_runner.run_cmd(cmd)
+    if report['status'] != 'ok':
+        raise StepFailed('{} exited with {}: {}'.format(cmd, report['exit_code'], stderr))
+    return report
+
+def evm_task(exec_dir, contig, weights):
+    report = runEVM.prediction(exec_dir, contig, weights)
+    if report['status'] not in ['ok', 'skipped']:
+        raise StepFailed(report)
+    return report
+
+def tsebra_task(exec_dir, cfg):
+    report, warnings = runTSEBRA.prediction(exec_dir, cfg)
+    if report['status'] not in ['ok', 'skipped']:
+        raise StepFailed(report)
+    return report, warnings
+
+def eval_task(exec_dir, method, gene_pred):
+    return method, eval_exp2.eval_pred(exec_dir, gene_pred)
+
+def parseCmd():
+    """Parse command line arguments
+
+    Returns:
+        dictionary: Dictionary with arguments
+    """
+    parser = argparse.ArgumentParser(description='Run all steps of TSEBRA-experiment 2 ' \
+        + '(partition.py, sample_partitions.py, runEVM.py, runTSEBRA.py, eval_exp2.py) ' \
+        + 'for one species and test level with one process pool.')
+    parser.add_argument('--species_dir', type=str,
+        help='Directory containing the results of TSEBRA-experiment 1 for one species')
+    parser.add_argument('--test_level', type=str,
+        help='One of "species_excluded", "family_excluded" or "order_excluded"')
+    parser.add_argument('--evm_path', type=str,
+        help='Path to the directory where EVidenceModeler is installed')
+    parser.add_argument('--threads', type=int, default=1,
+        help='Number of tasks that run at the same time')
+    parser.add_argument('--memory', type=float,
+        help='Start tasks only while their estimated memory fits into this limit (GB)')
+    parser.add_argument('--seed', type=str,
+        help='File with the seed value for sample_partitions.py, only used ' \
+        + 'if there is no part_test.lst')
+    parser.add_argument('--in_process', action='store_true',
+        help='Import TSEBRA once per worker instead of running tsebra.py for each partition')
+    parser.add_argument('--timeout', type=float,
+        help='Stop an EVM or TSEBRA run after this many seconds')
+    parser.add_argument('--retries', type=int, default=0,
+        help='Number of retries for an EVM or TSEBRA run that failed or timed out')
+    parser.add_argument('--parent_dir', type=str,
+        help='Run eval_summary.py for this directory with the results of all species ' \
+        + 'after the evaluation (optional)')
+    parser.add_argument('--plot', action='store_true',
+        help='Also run plot_exp2.py for --parent_dir')
+    parser.add_argument('--force', action='store_true',
+        help='Redo all steps, even if their inputs didn\'t change')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,14 @@
 # runTSEBRA.py: Run TSEBRA for a set of partitions
 # ==============================================================
 import argparse
-import subprocess as sp
-import multiprocessing as mp
 import os
 import csv
 import sys
+import shutil
+import checkpoint
+import job_runner
+import executor
+import tsebra_combine
 
 class FileMissing(Exception):
     pass
@@ -18,10 +21,22 @@ bin = os.path.dirname(os.path.realpath(__file__))
 workdir = ''
 partition_list = []
 cfg = ''
+force = False
+in_process = False
+# timeout (s) and number of retries of a TSEBRA run
+timeout = None
+retries = 0
+# TSEBRA parameters of each config file, only used if TSEBRA runs in-process
+parameters = {}
+# TSEBRA inputs of each partition
+tsebra_inputs = ['braker1.gtf', 'braker2.gtf', 'braker_pasa.gff', 'braker_protein.gff']
 
 def main():
-    global evm, workdir, partition_list, cfg, bin
+    global evm, workdir, partition_list, cfg, bin, force, in_process, timeout, retries
     args = parseCmd()
+    force = args.force
+    timeout = args.timeout
+    retries = args.retries
 
     workdir = os.path.abspath('{}/EVM/{}/'.format(args.species_dir, args.test_level))
 
@@ -37,36 +52,117 @@ def main():
     if not os.path.exists(cfg):
         raise FileMissing('Weight file is missing at: {}'.format(cfg))
 
+    # import TSEBRA and read the config once, the workers inherit both
+    if args.in_process:
+        try:
+            tsebra_combine.load_tsebra()
+            get_parameter(cfg)
+            in_process = True
+        except tsebra_combine.TsebraMissing as e:
+            sys.stderr.write('{}\nRunning tsebra.py as subprocess.\n'.format(e))
+
     #for part in partition_list:
         #prediction(part[3])
 
     # Run TSEBRA predicitons
-    job_results = []
-    pool = mp.Pool(args.threads)
+    results = {}
+    with executor.create(args.executor, args.threads, init_worker, \
+        ((cfg, force, in_process, timeout, retries),)) as ex:
+        for report, part_warnings in ex.map_unordered(prediction, \
+            [part[3] for part in partition_list]):
+            results[report['partition']] = (report, part_warnings)
+    warnings = []
+    reports = []
     for part in partition_list:
-        r = pool.apply_async(prediction, (part[3],))
-        job_results.append(r)
-    for r in job_results:
-        r.wait()
-    pool.close()
-    pool.join()
-
-def prediction(exec_dir):
-    # make a TSEBRA predcition for one partition and evaluate it
+        report, part_warnings = results[part[3]]
+        reports.append(report)
+        for w in part_warnings:
+            warnings.append([part[3], w])
+
+    # write status of all partitions, partitions that failed are rerun
+    # in the next run of runTSEBRA.py as they have no completion marker
+    manifest = '{}/tsebra_manifest.json'.format(workdir)
+    failed = job_runner.write_manifest(reports, manifest)
+    if failed:
+        sys.stderr.write('### TSEBRA failed for {} partitions:\n'.format(len(failed)))
+        for r in failed:
+            sys.stderr.write('{}\t{}\texit code {}\n'.format(r['partition'], \
+                r['status'], r['exit_code']))
+    sys.stderr.write('### Status of all partitions is located at {}\n'.format(manifest))
+
+    # write warnings of all partitions to one file
+    warnings_path = '{}/tsebra_warnings.tab'.format(workdir)
+    if os.path.exists(warnings_path):
+        os.remove(warnings_path)
+    if warnings:
+        with open(warnings_path, 'w+') as file:
+            csv.writer(file, delimiter='\t').writerows(warnings)
+        sys.stderr.write('{} TSEBRA warnings, see {}\n'.format(len(warnings), \
+            warnings_path))
+
+def init_worker(options):
+    # set the options of main in a worker of the executor, a worker
+    # on another node imports TSEBRA itself
+    global cfg, force, in_process, timeout, retries
+    cfg, force, in_process, timeout, retries = options
+    if in_process:
+        tsebra_combine.load_tsebra()
+        get_parameter(cfg)
+
+def get_parameter(cfg_path):
+    # parameters of a config file, each file is only read once per process
+    if cfg_path not in parameters:
+        parameters[cfg_path] = tsebra_combine.read_cfg(cfg_path)
+    return parameters[cfg_path]
+
+def prediction(exec_dir, cfg_path=''):
+    # make a TSEBRA predcition for one partition, returns the report of the run
+    # and the warnings of TSEBRA, cfg_path replaces the config file of the workdir (optional)
+    cfg_path = cfg_path or cfg
+
+    # skip partitions that have a TSEBRA prediction for the same inputs
+    tsebra_out = '{}/tsebra_EVM.gtf'.format(exec_dir)
+    tsebra = shutil.which('tsebra.py') or 'tsebra.py'
+    key = checkpoint.input_key(['{}/{}'.format(exec_dir, f) for f in tsebra_inputs] \
+        + [cfg_path, tsebra, '{}/tsebra_combine.py'.format(bin)], \
+        ['in_process' if in_process else 'subprocess'])
+    if not force and checkpoint.is_done(exec_dir, 'tsebra', key, [tsebra_out]):
+        return {'partition' : exec_dir, 'status' : 'skipped'}, []
+
+    gtf = ['{}/{}'.format(exec_dir, f) for f in tsebra_inputs[:2]]
+    hintfiles = ['{}/{}'.format(exec_dir, f) for f in tsebra_inputs[2:]]
+    if in_process:
+        warnings, report, error = job_runner.run_function(tsebra_combine.run, \
+            (gtf, hintfiles, get_parameter(cfg_path), tsebra_out), timeout, retries)
+        report['partition'] = exec_dir
+        if error:
+            sys.stderr.write('Error in TSEBRA for {} with: {}\n'.format(exec_dir, error))
+        if report['status'] != 'ok':
+            return report, []
+        checkpoint.mark_done(exec_dir, 'tsebra', key)
+        return report, warnings
+
     cmd = 'tsebra.py -g {}/braker1.gtf,{}/braker2.gtf '.format(exec_dir, exec_dir) \
         + '-e {}/braker_pasa.gff,{}/braker_protein.gff '.format(exec_dir, exec_dir) \
-        + '-c {} -o {}/tsebra_EVM.gtf -q'.format(cfg, exec_dir)
+        + '-c {} -o {}/tsebra_EVM.gtf -q'.format(cfg_path, exec_dir)
 
-    q = sp.Popen(cmd, shell=True, stdout=sp.PIPE, stderr=sp.PIPE)
-    stdout, stderr = q.communicate()
-    if stderr.decode():
+    report, stderr = job_runner.run_cmd(cmd, timeout, retries)
+    report['partition'] = exec_dir
+    warnings = []
+    if stderr:
         error = ''
-        for line in stderr.decode().split('\n'):
-            if not line[:8] == 'Skipping':
+        for line in stderr.split('\n'):
+            if line[:8] == 'Skipping':
+                warnings.append(line)
+            else:
                 error += line + '\n'
         if error.strip('\n'):
             sys.stderr.write('Error in {} with: {}'.format(cmd, error))
 
+    if report['status'] == 'ok':
+        checkpoint.mark_done(exec_dir, 'tsebra', key)
+    return report, warnings
+
 def parseCmd():
     """Parse command line arguments
 
@@ -80,6 +176,18 @@ def parseCmd():
         help='One of "species_excluded", "family_excluded" or "order_excluded"')
     parser.add_argument('--threads', type=int,
         help='')
+    parser.add_argument('--force', action='store_true',
+        help='Rerun TSEBRA for all partitions, even if their inputs didn\'t change')
+    parser.add_argument('--in_process', action='store_true',
+        help='Import TSEBRA once per worker instead of running tsebra.py for each ' \
+        + 'partition, falls back to tsebra.py if its modules can\'t be imported')
+    parser.add_argument('--timeout', type=float,
+        help='Stop a TSEBRA run after this many seconds')
+    parser.add_argument('--retries', type=int, default=0,
+        help='Number of retries for a TSEBRA run that failed or timed out')
+    parser.add_argument('--executor', type=str, default='pool',
+        help='"pool" (default) or "socket:<host>:<port>" to distribute the partitions ' \
+        + 'to worker daemons started with executor.py --address <host>:<port>')
     return parser.parse_args()
 
 if __name__ == '__main__':
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# sweepEVM.py: Evaluate a set of EVM weight files on the training
+# partitions and report the best weights
+# ==============================================================
+import argparse
+import multiprocessing as mp
+import os
+import csv
+import sys
+import runEVM
+import eval_exp2
+from compare_intervals import Score
+from sweepTSEBRA import make_configs
+
+class FileMissing(Exception):
+    pass
+
+class WeightsError(Exception):
+    pass
+
+workdir = ''
+sweep_dir = ''
+modes = ['cds', 'trans', 'gene']
+# files of a partition that are linked into the directories of all weight files
+partition_files = runEVM.evm_inputs
+
+def main():
+    global workdir, sweep_dir
+    args = parseCmd()
+
+    workdir = os.path.abspath('{}/EVM/{}/'.format(args.species_dir, args.test_level))
+    sweep_dir = os.path.abspath(args.out or '{}/evm_sweep'.format(workdir))
+    runEVM.evm = os.path.abspath(args.evm_path)
+    runEVM.force = args.force
+
+    # read training partitions
+    partition_list = []
+    with open('{}/partitions/part_train.lst'.format(workdir), 'r') as file:
+        part = csv.reader(file, delimiter='\t')
+        for p in part:
+            partition_list.append(p)
+
+    # weights: all combinations of the grid values or a random sample of them,
+    # weights that aren't in the grid are taken from the base weight file
+    base = {k : v[0] for k, v in read_weights(args.weights or \
+        '{}/EVM.weights.tab'.format(workdir)).items()}
+    grid = read_weights(args.grid)
+    configs = make_configs(base, grid, args.random, args.seed)
+    weight_files = []
+    for i, config in enumerate(configs):
+        weight_files.append('{}/weights_{}.tab'.format(sweep_dir, i))
+        prepare_dir('{}/weights_{}'.format(sweep_dir, i), partition_list)
+        write_weights(config, weight_files[-1])
+    sys.stderr.write('### Evaluating {} weight files on {} partitions\n'.format(\
+        len(configs), len(partition_list)))
+
+    # all weight files of a partition are queued after another, the EVM runs
+    # are spread over all workers and each worker parses the reference annotation
+    # of a partition only once (cache of eval_exp2.get_reference)
+    jobs = []
+    for part in sorted(partition_list, key=lambda p:eval_exp2.partition_size(p[3]), \
+        reverse=True):
+        for i in range(len(configs)):
+            jobs.append((i, part[3], part[0], weight_files[i]))
+    total = [{m : Score(0,0,0) for m in modes} for c in configs]
+    failed = [[] for c in configs]
+    with mp.Pool(args.threads) as pool:
+        for i, score, report in pool.imap_unordered(eval_job, jobs):
+            if score is None:
+                failed[i].append(report)
+                continue
+            for m in modes:
+                total[i][m] = eval_exp2.sum_score_lst([total[i][m], score[m]])
+
+    # weight files with a failed EVM run aren't ranked, their scores would
+    # count the missing predictions as false negatives
+    for i, reports in enumerate(failed):
+        for r in reports:
+            sys.stderr.write('### EVM failed for weights_{}: {}\t{}\texit code {}\n'.format(\
+                i, r['partition'], r['status'], r['exit_code']))
+
+    # write table of all weight files, best gene and transcript F1 first
+    names = list(base.keys())
+    tab = []
+    for i, config in enumerate(configs):
+        line = [i] + [config[n] for n in names]
+        for m in modes:
+            line += [100 * total[i][m].f1(), 100 * total[i][m].sens(), \
+                100 * total[i][m].spec()]
+        line.append('failed ({} partitions)'.format(len(failed[i])) if failed[i] else 'ok')
+        tab.append(line)
+    tab.sort(key=lambda l:(bool(failed[l[0]]), -total[l[0]]['gene'].f1(), \
+        -total[l[0]]['trans'].f1(), l[0]))
+    header = ['# weights'] + ['{}:{}'.format(*n) for n in names]
+    for m in modes:
+        header += ['{}_F1'.format(m), '{}_Sn'.format(m), '{}_Sp'.format(m)]
+    header.append('status')
+    eval_exp2.csv_writer([header] + tab, '{}/sweep.tab'.format(sweep_dir))
+
+    if failed[tab[0][0]]:
+        sys.stderr.write('### EVM failed for all weight files, see {}/sweep.tab\n'.format(\
+            sweep_dir))
+        return
+    best = configs[tab[0][0]]
+    write_weights(best, '{}/best.weights.tab'.format(sweep_dir))
+    sys.stderr.write('### Best weights (gene F1 {:.2f}, transcript F1 {:.2f}) '.format(\
+        100 * total[tab[0][0]]['gene'].f1(), 100 * total[tab[0][0]]['trans'].f1()) \
+        + 'are located at {}/best.weights.tab\n'.format(sweep_dir))
+
+def read_weights(path):
+    # read an EVM weight file ('<class> <source> <weight>') or a grid
+    # file with several weights per line ('<class> <source> <weight1> <weight2> ...'),
+    # returns a dictionary (class, source) -> weight(s)
+    weights = {}
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.split()
+            if not line or line[0][0] == '#':
+                continue
+            if len(line) < 3:
+                raise WeightsError('Weight missing in {}: {}'.format(path, ' '.join(line)))
+            weights[(line[0], line[1])] = line[2:]
+    return weights
+
+def write_weights(config, path):
+    with open(path, 'w+') as file:
+        for (evi_class, src), weight in config.items():
+            file.write('{}\t{}\t{}\n'.format(evi_class, src, weight))
+
+def prepare_dir(config_dir, partition_list):
+    # create a directory for each partition that links to the
+    # EVM inputs of the partition, they are shared by all weight files
+    for part in partition_list:
+        part_dir = '{}/{}'.format(config_dir, os.path.basename(part[3].rstrip('/')))
+        if not os.path.exists(part_dir):
+            os.makedirs(part_dir)
+        for file_name in partition_files:
+            source = '{}/{}'.format(part[3], file_name)
+            link = '{}/{}'.format(part_dir, file_name)
+            if not os.path.exists(source):
+                raise FileMissing('{} is missing.'.format(source))
+            if not os.path.lexists(link):
+                os.symlink(source, link)
+
+def eval_job(job):
+    # run EVM with one weight file for one partition and evaluate its prediction
+    i, part_dir, contig, weight_file = job
+    exec_dir = '{}/weights_{}/{}'.format(sweep_dir, i, os.path.basename(part_dir.rstrip('/')))
+    # prediction removes the evm.gtf of an earlier run (e.g. of another
+    # weight file with the same index) before it runs EVM
+    report = runEVM.prediction(exec_dir, contig, weight_file)
+    if report['status'] not in ['ok', 'skipped']:
+        return i, None, report
+    gtf = '{}/evm.gtf'.format(exec_dir)
+    return i, eval_exp2.eval_files(part_dir, gtf), report
+
+def parseCmd():
+    """Parse command line arguments
+
+    Returns:
+        dictionary: Dictionary with arguments
+    """
+    parser = argparse.ArgumentParser(description='Evaluate a set of EVM weight ' \
+        + 'files on the training partitions.')
+    parser.add_argument('--species_dir', type=str,
+        help='Directory containing the results of TSEBRA-experiment 1 for one species')
+    parser.add_argument('--test_level', type=str,
+        help='One of "species_excluded", "family_excluded" or "order_excluded"')
+    parser.add_argument('--evm_path', type=str,
+        help='Path to the directory where EVidenceModeler is installed')
+    parser.add_argument('--grid', type=str,
+        help='File with the weights of the sweep, one line per evidence source: ' \
+        + '"<class> <source> <weight1> <weight2> ..."')
+    parser.add_argument('--weights', type=str,
+        help='Weight file with all weights that are not in the grid ' \
+        + '(default: $species_dir/EVM/$test_level/EVM.weights.tab)')
+    parser.add_argument('--random', type=int, default=0,
+        help='Evaluate only a random sample of this many weight files of the grid')
+    parser.add_argument('--seed', type=int,
+        help='Seed value for --random')
+    parser.add_argument('--out', type=str,
+        help='Output directory (default: $species_dir/EVM/$test_level/evm_sweep/)')
+    parser.add_argument('--threads', type=int,
+        help='')
+    parser.add_argument('--force', action='store_true',
+        help='Rerun EVM for all weight files, even if their inputs didn\'t change')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    main()
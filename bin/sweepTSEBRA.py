@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# sweepTSEBRA.py: Evaluate a set of TSEBRA parameter configurations
+# on the training partitions and report the best configuration
+# ==============================================================
+import argparse
+import multiprocessing as mp
+import itertools
+import random
+import tempfile
+import os
+import csv
+import sys
+import tsebra_combine
+import eval_exp2
+from compare_intervals import Score
+
+class FileMissing(Exception):
+    pass
+
+bin = os.path.dirname(os.path.realpath(__file__))
+workdir = ''
+modes = ['cds', 'trans', 'gene']
+# TSEBRA inputs of each partition
+gtf_files = ['braker1.gtf', 'braker2.gtf']
+hint_files = ['braker_pasa.gff', 'braker_protein.gff']
+configs = []
+
+def main():
+    global workdir, configs
+    args = parseCmd()
+
+    workdir = os.path.abspath('{}/EVM/{}/'.format(args.species_dir, args.test_level))
+    out_dir = args.out or '{}/tsebra_sweep'.format(workdir)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    # read training partitions
+    partition_list = []
+    with open('{}/partitions/part_train.lst'.format(workdir), 'r') as file:
+        part = csv.reader(file, delimiter='\t')
+        for p in part:
+            partition_list.append(p[3])
+
+    # parameter sets: all combinations of the grid values or a random sample
+    # of them, parameters that aren't in the grid are taken from the base config
+    base = tsebra_combine.read_cfg(args.cfg)
+    grid = read_grid(args.grid)
+    configs = make_configs(base, grid, args.random, args.seed)
+    sys.stderr.write('### Evaluating {} configurations on {} partitions\n'.format(\
+        len(configs), len(partition_list)))
+
+    # import TSEBRA before the workers are started
+    tsebra_combine.load_tsebra()
+
+    # one job per partition, its inputs are parsed once for all configurations
+    total = [{m : Score(0,0,0) for m in modes} for c in configs]
+    with mp.Pool(args.threads) as pool:
+        for scores in pool.imap_unordered(eval_partition, partition_list):
+            for i, score in enumerate(scores):
+                for m in modes:
+                    total[i][m] = eval_exp2.sum_score_lst([total[i][m], score[m]])
+
+    # write table of all configurations, best gene and transcript F1 first
+    names = list(base.keys())
+    tab = []
+    for i, config in enumerate(configs):
+        line = [i] + [config[n] for n in names]
+        for m in modes:
+            line += [100 * total[i][m].f1(), 100 * total[i][m].sens(), \
+                100 * total[i][m].spec()]
+        tab.append(line)
+    tab.sort(key=lambda l:(-total[l[0]]['gene'].f1(), -total[l[0]]['trans'].f1(), l[0]))
+    header = ['# config'] + names
+    for m in modes:
+        header += ['{}_F1'.format(m), '{}_Sn'.format(m), '{}_Sp'.format(m)]
+    eval_exp2.csv_writer([header] + tab, '{}/sweep.tab'.format(out_dir))
+
+    best = configs[tab[0][0]]
+    write_cfg(best, '{}/best.cfg'.format(out_dir))
+    sys.stderr.write('### Best configuration (gene F1 {:.2f}, transcript F1 {:.2f}) '.format(\
+        100 * total[tab[0][0]]['gene'].f1(), 100 * total[tab[0][0]]['trans'].f1()) \
+        + 'is located at {}/best.cfg\n'.format(out_dir))
+
+def read_grid(path):
+    # read parameter values of the sweep, one line per parameter
+    # in the format of a TSEBRA config file: '<parameter> <value1> <value2> ...'
+    grid = {}
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.split()
+            if not line or line[0][0] == '#':
+                continue
+            grid[line[0]] = [float(v) for v in line[1:]]
+    return grid
+
+def make_configs(base, grid, sample_size=0, seed=None):
+    """Create parameter sets from a grid
+
+    Args:
+        base (dict): default values of all parameters
+        grid (dict): list of values for each parameter of the sweep
+        sample_size (int): number of parameter sets that are sampled from
+            the grid, all combinations are used if it is 0
+        seed (int): seed value for the sampling
+
+    Returns:
+        list: parameter dictionary for each configuration
+    """
+    names = list(grid.keys())
+    combinations = list(itertools.product(*[grid[n] for n in names]))
+    if sample_size and sample_size < len(combinations):
+        rng = random.Random(seed)
+        combinations = [combinations[i] for i in \
+            sorted(rng.sample(range(len(combinations)), sample_size))]
+    result = []
+    for values in combinations:
+        config = dict(base)
+        config.update(zip(names, values))
+        result.append(config)
+    return result
+
+def write_cfg(parameter, path):
+    with open(path, 'w+') as file:
+        for name, value in parameter.items():
+            file.write('{} {}\n'.format(name, value))
+
+def eval_partition(exec_dir):
+    # run TSEBRA with all configurations for one partition and evaluate
+    # the results, returns a score dictionary for each configuration
+    for file_name in gtf_files + hint_files + ['annot.gtf']:
+        if not os.path.exists('{}/{}'.format(exec_dir, file_name)):
+            raise FileMissing('{}/{} is missing.'.format(exec_dir, file_name))
+    anno, evi = tsebra_combine.read_inputs( \
+        ['{}/{}'.format(exec_dir, f) for f in gtf_files], \
+        ['{}/{}'.format(exec_dir, f) for f in hint_files])[:2]
+
+    scores = []
+    fd, tmp = tempfile.mkstemp(suffix='.gtf', dir=exec_dir)
+    os.close(fd)
+    try:
+        for config in configs:
+            combined_anno = tsebra_combine.combine(anno, evi, config)[0]
+            combined_anno.write_anno(tmp)
+            scores.append(eval_exp2.eval_files(exec_dir, tmp))
+    finally:
+        os.remove(tmp)
+    return scores
+
+def parseCmd():
+    """Parse command line arguments
+
+    Returns:
+        dictionary: Dictionary with arguments
+    """
+    parser = argparse.ArgumentParser(description='Evaluate a set of TSEBRA ' \
+        + 'parameter configurations on the training partitions.')
+    parser.add_argument('--species_dir', type=str,
+        help='Directory containing the results of TSEBRA-experiment 1 for one species')
+    parser.add_argument('--test_level', type=str,
+        help='One of "species_excluded", "family_excluded" or "order_excluded"')
+    parser.add_argument('--grid', type=str,
+        help='File with the values of the sweep, one line per parameter: ' \
+        + '"<parameter> <value1> <value2> ..."')
+    parser.add_argument('--cfg', type=str, default='{}/../config/default.cfg'.format(bin),
+        help='TSEBRA config with the values of all parameters that are not in ' \
+        + 'the grid (default: config/default.cfg)')
+    parser.add_argument('--random', type=int, default=0,
+        help='Evaluate only a random sample of this many configurations of the grid')
+    parser.add_argument('--seed', type=int,
+        help='Seed value for --random')
+    parser.add_argument('--out', type=str,
+        help='Output directory (default: $species_dir/EVM/$test_level/tsebra_sweep/)')
+    parser.add_argument('--threads', type=int,
+        help='')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    main()
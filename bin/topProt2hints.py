@@ -7,73 +7,112 @@
 import argparse
 import csv
 import re
+from gff_utils import decode_attributes
+
+class NotGrouped(Exception):
+    pass
+
+type_translate = {'intron' : 'intron',
+                'start_codon' : 'start',
+                'stop_codon' : 'stop'}
+# compiled expressions for the attributes of the alignment ID
+attr_exp = {name : re.compile(r'(?:^|;)\s*{}=([^;]*)'.format(name)) \
+    for name in ['prot', 'seed_gene_id']}
 
 def main():
     args = parseCmd()
-    evm_out = []
-    braker_out = []
-    type_translate = {  'Intron' : 'intron',
-                    'start_codon' : 'start',
-                    'stop_codon' : 'stop'}
+    # the alignments are written as soon as they are complete, if the lines
+    # of an alignment aren't consecutive, all alignments are kept in memory
+    try:
+        write_hints(args.topProts, args.evm_out, args.braker_out)
+    except NotGrouped:
+        write_hints(args.topProts, args.evm_out, args.braker_out, grouped=False)
+
+def write_hints(path, evm_out, braker_out, grouped=True):
+    """Write the CDS of each alignment as protein_match lines in EVM
+    format and the intron, start and stop hints with their multiplicity
+
+    Args:
+        path (str): protein alignments in gff format
+        evm_out (str): output of the alignments
+        braker_out (str): output of the intron, start and stop hints
+        grouped (bool): the lines of each alignment are consecutive in path
+
+    Raises:
+        NotGrouped: if grouped is set and an alignment is not consecutive
+    """
+    # hints : (seqid, start, end, strand) -> [line of first occurrence, mult]
     braker_hints = {}
     evm_hints = {}
-
-    # read protein alignments
-    with open(args.topProts, 'r') as file:
-        topProtGff = csv.reader(file, delimiter='\t')
-        for line in topProtGff:
-            if line[2].lower() == 'cds':
-                id = get_new_id(line[8])
-                line[8] = 'ID={};'.format(id)
+    done = set()
+    with open(evm_out, 'w+') as file, open(path, 'r') as file_in:
+        outGff = csv.writer(file, delimiter='\t')
+        attributes, id = None, None
+        for line in file_in:
+            line = line.rstrip('\n').split('\t')
+            if len(line) != 9:
+                continue
+            f_type = line[2].lower()
+            if f_type == 'cds':
+                # consecutive lines of an alignment often have the same attributes
+                if line[8] != attributes:
+                    attributes = line[8]
+                    id = get_new_id(attributes)
+                if grouped and id not in evm_hints:
+                    if id in done:
+                        raise NotGrouped()
+                    for prev_id, lines in evm_hints.items():
+                        outGff.writerows(merge_alignment(lines))
+                        done.add(prev_id)
+                    evm_hints = {}
+                if id not in evm_hints:
+                    evm_hints[id] = []
                 line[2] = 'protein_match'
                 line[3] = int(line[3])
                 line[4] = int(line[4])
-                if not id in evm_hints.keys():
-                    evm_hints.update({id : []})
+                line[8] = 'ID={};'.format(id)
                 evm_hints[id].append(line)
-            elif line[2].lower() in ['intron', 'start_codon', 'stop_codon']:
-                key = '{}_{}_{}_{}'.format(line[0], line[3], line[4], line[6])
-                if key not in braker_hints.keys():
-                    braker_hints.update({key : [line, 0]})
+            elif f_type in type_translate:
+                key = (line[0], int(line[3]), int(line[4]), line[6])
+                if key not in braker_hints:
+                    line[3], line[4] = key[1], key[2]
+                    braker_hints[key] = [line, 0]
                 braker_hints[key][1] += 1
+        for lines in evm_hints.values():
+            outGff.writerows(merge_alignment(lines))
 
-    # remove small gaps in alignments
-    for key in evm_hints.keys():
-        tx = sorted(evm_hints[key], key = lambda l:l[3])
-        out = [tx[0]]
-        for line in tx[1:]:
-            if (line[3] - out[-1][4]) < 3:
-                out[-1][4] = line[4]
-            else:
-                out.append(line)
-        if out[0][6] == '-':
-            out.reverse()
-        if len(out) > 1:
-            evm_out += out
-
-    # write hints to files
-    for value in braker_hints.values():
-        value[0][2] = type_translate[value[0][2]]
-        value[0][8] = 'mult={};src=P;pri=4'.format(value[1])
-        braker_out.append(value[0])
-
-    with open(args.evm_out, 'w+') as file:
-        outGff = csv.writer(file, delimiter='\t')
-        for line in evm_out:
-            outGff.writerow(line)
-
-    with open(args.braker_out, 'w+') as file:
+    with open(braker_out, 'w+') as file:
         outGff = csv.writer(file, delimiter='\t')
-        for line in braker_out:
+        for line, mult in braker_hints.values():
+            line[2] = type_translate[line[2].lower()]
+            line[8] = 'mult={};src=P;pri=4'.format(mult)
             outGff.writerow(line)
 
-def get_attribute(attributes, a_name):
-    expression = a_name + '=([^;]+)'
-    return re.search(expression, attributes).groups()[0]
+def merge_alignment(lines):
+    # remove small gaps in an alignment, returns its lines in the direction
+    # of its strand or no lines if only one remains
+    lines.sort(key=lambda l:l[3])
+    out = [lines[0]]
+    for line in lines[1:]:
+        if (line[3] - out[-1][4]) < 3:
+            out[-1][4] = line[4]
+        else:
+            out.append(line)
+    if out[0][6] == '-':
+        out.reverse()
+    if len(out) > 1:
+        return out
+    return []
 
 def get_new_id(attributes):
-    return '{}.{}'.format(get_attribute(attributes, 'prot'), \
-        get_attribute(attributes, 'seed_gene_id'))
+    values = []
+    for name in ['prot', 'seed_gene_id']:
+        match = attr_exp[name].search(attributes)
+        if match:
+            values.append(match.group(1).rstrip())
+        else:
+            values.append(decode_attributes(attributes).get(name))
+    return '{}.{}'.format(*values)
 
 def parseCmd():
     """Parse command line arguments
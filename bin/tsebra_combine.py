@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# ==============================================================
+# author: Lars Gabriel
+#
+# tsebra_combine.py: Run the combine routine of TSEBRA in-process,
+# the TSEBRA modules are imported once per process
+# ==============================================================
+import contextlib
+import io
+import os
+import shutil
+import sys
+
+class TsebraMissing(Exception):
+    pass
+
+# TSEBRA classes (Anno, Evidence, Graph), imported by load_tsebra()
+tsebra = None
+
+def load_tsebra(tsebra_path=None):
+    """Import the modules of TSEBRA from the directory of tsebra.py
+
+    Args:
+        tsebra_path (str): path to tsebra.py, default is the one in $PATH
+
+    Returns:
+        dict: TSEBRA classes 'Anno', 'Evidence' and 'Graph'
+    """
+    global tsebra
+    if tsebra is not None:
+        return tsebra
+    tsebra_path = tsebra_path or shutil.which('tsebra.py')
+    if not tsebra_path:
+        raise TsebraMissing('tsebra.py is not in $PATH.')
+    tsebra_bin = os.path.dirname(os.path.realpath(tsebra_path))
+    if tsebra_bin not in sys.path:
+        sys.path.append(tsebra_bin)
+    try:
+        from genome_anno import Anno
+        from evidence import Evidence
+        from overlap_graph import Graph
+    except ImportError as e:
+        raise TsebraMissing('Could not import the TSEBRA modules from {}: {}'.format(\
+            tsebra_bin, e))
+    tsebra = {'Anno' : Anno, 'Evidence' : Evidence, 'Graph' : Graph}
+    return tsebra
+
+def read_cfg(cfg_file):
+    # read a TSEBRA config file ('<parameter> <value>' per line),
+    # same as set_parameter() of tsebra.py
+    parameter = {'P' : 0, 'E' : 0, 'C' : 0, 'M' : 0, 'intron_support' : 0, \
+        'stasto_support' : 0, 'e_1' : 0, 'e_2' : 0, 'e_3' : 0, 'e_4' : 0}
+    with open(cfg_file, 'r') as file:
+        for line in file:
+            line = line.split()
+            if not line or line[0][0] == '#':
+                continue
+            parameter[line[0]] = float(line[1])
+    return parameter
+
+@contextlib.contextmanager
+def capture_warnings(warnings):
+    # collect everything TSEBRA writes to stderr as a list of lines
+    stderr = io.StringIO()
+    with contextlib.redirect_stderr(stderr):
+        yield
+    warnings += [w for w in stderr.getvalue().split('\n') if w.strip()]
+
+def read_inputs(gtf, hintfiles):
+    """Read the gene predictions and hint files of a TSEBRA run
+
+    Args:
+        gtf (list): paths to gene predictions in gtf format
+        hintfiles (list): paths to hint files
+
+    Returns:
+        list: Anno object for each gene prediction
+        Evidence: evidence of all hint files
+        list: warnings of TSEBRA
+    """
+    load_tsebra()
+    warnings = []
+    anno = []
+    with capture_warnings(warnings):
+        for i, g in enumerate(gtf):
+            anno.append(tsebra['Anno'](g, 'anno{}'.format(i + 1)))
+            anno[-1].addGtf()
+            anno[-1].norm_tx_format()
+        evi = tsebra['Evidence']()
+        for h in hintfiles:
+            evi.add_hintfile(h)
+    return anno, evi, warnings
+
+def combine(anno, evi, parameter):
+    """Select transcripts from the gene predictions, same steps as
+    the main function of tsebra.py
+
+    Args:
+        anno (list): Anno object for each gene prediction
+        evi (Evidence): extrinsic evidence
+        parameter (dict): TSEBRA parameters (see read_cfg)
+
+    Returns:
+        Anno: combined gene prediction
+        list: warnings of TSEBRA
+    """
+    load_tsebra()
+    warnings = []
+    parameter = dict(parameter)
+    for src in evi.src:
+        if src not in parameter:
+            warnings.append('ConfigError: No weight for src={}, it is set to 1'.format(src))
+            parameter[src] = 1
+    with capture_warnings(warnings):
+        graph = tsebra['Graph'](anno, para=parameter, verbose=0)
+        graph.build()
+        graph.add_node_features(evi)
+        combined_prediction = graph.get_decided_graph()
+        combined_anno = tsebra['Anno']('', 'combined_annotation')
+        for a in anno:
+            for tx in a.get_subset(combined_prediction[a.id]):
+                combined_anno.transcripts.update({tx.id : tx})
+        combined_anno.find_genes()
+    return combined_anno, warnings
+
+def run(gtf, hintfiles, parameter, out):
+    # read the inputs, combine them and write the result to out,
+    # returns the warnings of TSEBRA
+    anno, evi, warnings = read_inputs(gtf, hintfiles)
+    combined_anno, combine_warnings = combine(anno, evi, parameter)
+    with capture_warnings(combine_warnings):
+        combined_anno.write_anno(out)
+    return warnings + combine_warnings